@@ -23,6 +23,10 @@ import logging
 import unittest
 from datetime import datetime
 import calendar
+import os
+import mmap
+import multiprocessing
+from collections import deque
 
 # ADIF field names and their associated data types available in PyQSO.
 AVAILABLE_FIELD_NAMES_TYPES = {"CALL": "S", 
@@ -94,6 +98,111 @@ BANDS_RANGES = [(None, None), (0.136, 0.137), (0.501, 0.504), (1.8, 2.0), (3.5,
 
 ADIF_VERSION = "1.0"
 
+# The number of characters read from an ADIF file at a time when streaming records with ADIF.iter_records.
+CHUNK_SIZE = 1024*1024
+# The size (in bytes) of the buffer used when writing an ADIF file with ADIF.write.
+WRITE_BUFFER_SIZE = 1024*1024
+# The maximum number of distinct tags (e.g. <call:6>) whose field name and length are remembered while scanning an ADIF file with ADIF._scan.
+MAX_CACHED_TAGS = 10000
+# The approximate size (in bytes) of each part of an ADIF file that is parsed by a separate process with ADIF.iter_records_parallel.
+RANGE_SIZE = 16*1024*1024
+
+# Frozensets of the enumerations in MODES and BANDS, for fast membership tests when validating data.
+MODES_SET = frozenset(MODES)
+BANDS_SET = frozenset(BANDS)
+
+# Precompiled regular expressions used to validate data. Most of the data types are validated with re.match, followed by a check
+# that the whole string was matched (otherwise there may be an invalid character after the match).
+NUMBER_PATTERN = re.compile(r"-?(([0-9]+\.?[0-9]*)|([0-9]*\.?[0-9]+))") # Allow a decimal point before and/or after any numbers, but not a decimal point on its own.
+BOOLEAN_PATTERN = re.compile(r"(Y|N)")
+DATE_PATTERN = re.compile(r"([0-9]{4})([0-9]{2})([0-9]{2})$") # YYYYMMDD
+TIME_PATTERN = re.compile(r"([0-9]{2})([0-9]{2})([0-9]{2})?$") # HHMM or HHMMSS
+#FIXME: Need to make sure that the "S" and "M" data types accept ASCII-only characters
+# in the range 32-126 inclusive.
+STRING_PATTERN = re.compile(r"(.+)")
+INTERNATIONAL_STRING_PATTERN = re.compile(ur"(.+)", re.UNICODE)
+INTERNATIONAL_MULTILINE_STRING_PATTERN = re.compile(ur"(.+(\r\n)*.*)", re.UNICODE)
+LOCATION_PATTERN = re.compile(r"([EWNS]{1})([0-9]{3})([0-9]{2}\.[0-9]{3})$", re.IGNORECASE) # e.g. N051 30.000, without the space.
+
+def _match_whole(pattern):
+   """ Return a function which checks that the given precompiled pattern matches the whole of its argument. """
+   match = pattern.match
+   def validator(data):
+      m = match(data)
+      return (m is not None and m.group(0) == data)
+   return validator
+
+def _is_valid_date(data):
+   m = DATE_PATTERN.match(data)
+   if(m is None or len(data) != 8):
+      return False
+   (year, month, day) = [int(x) for x in m.groups()]
+   if(year < 1930 or month < 1 or month > 12):
+      return False
+   return (1 <= day <= calendar.monthrange(year, month)[1])
+
+def _is_valid_time(data):
+   m = TIME_PATTERN.match(data)
+   if(m is None or len(data) not in (4, 6)):
+      return False
+   (hours, minutes, seconds) = m.groups()
+   return (int(hours) <= 23 and int(minutes) <= 59 and (seconds is None or int(seconds) <= 59))
+
+def _is_valid_location(data):
+   m = LOCATION_PATTERN.match(data)
+   if(m is None or len(data) != 10):
+      return False
+   return (int(m.group(2)) <= 180 and float(m.group(3)) <= 59.999)
+
+def _is_always_valid(data):
+   return True
+
+# The function used to validate the data of each data type. Data types not listed here (e.g. multi-line strings) are not validated.
+DATA_TYPE_VALIDATORS = {"N": _match_whole(NUMBER_PATTERN),
+                        "B": _match_whole(BOOLEAN_PATTERN),
+                        "D": _is_valid_date,
+                        "T": _is_valid_time,
+                        "S": _match_whole(STRING_PATTERN),
+                        "I": _match_whole(INTERNATIONAL_STRING_PATTERN),
+                        "G": _match_whole(INTERNATIONAL_MULTILINE_STRING_PATTERN),
+                        "L": _is_valid_location}
+# The enumerations which are checked against a set of allowed values.
+ENUMERATIONS = {"MODE": MODES_SET, "BAND": BANDS_SET}
+
+def get_validator(field_name, data_type):
+   """ Return a function which takes the (non-empty) data in a field with a given name and data type, and returns True if the data is valid. """
+   if(data_type == "E" or data_type == "A"):
+      # Enumeration, AwardList.
+      if(field_name in ENUMERATIONS):
+         return ENUMERATIONS[field_name].__contains__
+      else:
+         return _is_always_valid
+   return DATA_TYPE_VALIDATORS.get(data_type, _is_always_valid)
+
+# The function used to validate the data in each of the ADIF fields available in PyQSO.
+FIELD_VALIDATORS = dict([(field_name, get_validator(field_name, data_type)) for (field_name, data_type) in AVAILABLE_FIELD_NAMES_TYPES.items()])
+
+def _parse_range(arguments):
+   """ Parse the records in a given byte range of an ADIF file. This is run in a worker process by ADIF.iter_records_parallel, so it is a module-level function.
+   The 'arguments' are the file's path, and the start and end of the byte range. Return a tuple containing a list of (record, position) tuples for the
+   (validated) records in the range, where 'position' is the position in the file just after the record's <eor> marker,
+   and the position in the file just after the last complete record in the range. """
+   (path, start, end) = arguments
+   adif = ADIF()
+   f = open(path, 'rb')
+   try:
+      text = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+   finally:
+      f.close()
+   try:
+      records = []
+      position = start
+      for (fields, position) in adif._scan(text, start, end):
+         records.append((adif._clean_record(fields), position))
+   finally:
+      text.close()
+   return (records, position)
+
 class ADIF:
    """ The ADIF class supplies methods for reading, parsing, and writing log files in the Amateur Data Interchange Format (ADIF). For more information, visit http://adif.org/ """
    
@@ -107,23 +216,166 @@ class ADIF:
       e.g. {FREQ:145.500, BAND:2M, MODE:FM}. """
       logging.debug("Reading in ADIF file with path: %s..." % path)
 
-      text = ""      
-      try:
-         f = open(path, 'r')
-         text = f.read()
-         f.close() # Close the file, otherwise "bad things" might happen!
-      except IOError as e:
-         logging.error("I/O error %d: %s" % (e.errno, e.strerror))
-      except:
-         logging.error("Unknown error occurred when reading the ADIF file.")
-
-      records = self._parse_adi(text)
+      records = list(self.iter_records(path))
          
       if(records == []):
          logging.warning("No records found in the file. Empty file or wrong file type?")
          
       return records
+
+   def iter_records(self, path, chunk_size=CHUNK_SIZE, start=0, use_mmap=True, positions=False):
+      """ Read an ADIF file with a specified path (given in the 'path' argument) in chunks of 'chunk_size' characters, and yield the records one at a time
+      as they are parsed. Each record is a dictionary containing field-value pairs, e.g. {FREQ:145.500, BAND:2M, MODE:FM}.
+      Unlike the read method, the file is never copied into memory in full. If 'use_mmap' is True, the file is memory-mapped where possible and scanned in place,
+      so that only the field data which is kept gets copied. Otherwise (or if the file cannot be memory-mapped, e.g. because it is empty) it is read
+      in chunks of 'chunk_size' characters, with any partial record carried over from the previous chunk.
+      If 'start' is given, then reading starts from that position in the file (which should be the start of a record, or the start of the file).
+      If 'positions' is True, then a (record, position) tuple is yielded for each record instead, where 'position' is the position in the file
+      just after the record's <eor> marker (i.e. where reading should start from in order to skip the record and all those before it). """
+      logging.debug("Reading in ADIF file with path: %s..." % path)
+
+      try:
+         f = open(path, 'r')
+         f.seek(start)
+      except IOError as e:
+         logging.error("I/O error %d: %s" % (e.errno, e.strerror))
+         return
+
+      text = None
+      if(use_mmap):
+         try:
+            text = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+         except (ValueError, EnvironmentError):
+            # Empty files (and some special files) cannot be memory-mapped.
+            pass
+
+      if(text is not None):
+         f.close()
+         try:
+            for (fields, position) in self._scan(text, start):
+               if(positions):
+                  yield (self._clean_record(fields), position)
+               else:
+                  yield self._clean_record(fields)
+         finally:
+            text.close()
+         logging.debug("Finished reading the ADIF file.")
+         return
+
+      try:
+         buffer = ""
+         offset = start # The position in the file of the start of the buffer.
+         while True:
+            chunk = f.read(chunk_size)
+            buffer = buffer + chunk
+            # Yield every complete record in the buffer. Any partial record (e.g. a <field:len> tag that has been cut in half
+            # at the end of the chunk) is carried over and completed by the next chunk.
+            position = 0
+            for (fields, position) in self._scan(buffer):
+               if(positions):
+                  yield (self._clean_record(fields), offset + position)
+               else:
+                  yield self._clean_record(fields)
+            buffer = buffer[position:]
+            offset = offset + position
+            if(chunk == ""):
+               # Anything after the final <eor> marker should be ignored.
+               break
+      except IOError as e:
+         logging.error("I/O error %d: %s" % (e.errno, e.strerror))
+      finally:
+         f.close() # Close the file, otherwise "bad things" might happen!
+
+      logging.debug("Finished reading the ADIF file.")
+      return
       
+   def iter_records_parallel(self, path, processes=None, range_size=RANGE_SIZE, start=0, positions=False):
+      """ The same as the iter_records method, except that the file is split into byte ranges of about 'range_size' bytes (each ending with an <eor> marker)
+      which are parsed (and validated) by a pool of 'processes' worker processes. The number of processes defaults to the number of CPUs.
+      The records are still yielded one at a time, in the same order as in the file, so the output is identical to that of iter_records.
+      Only a few byte ranges are parsed ahead of the records that have been yielded, so the memory usage does not depend on the size of the file.
+      The 'start' and 'positions' arguments have the same meaning as they do for iter_records.
+      Note that the worker processes are forked from the current process, so this must not be used from a multi-threaded process (such as the PyQSO user interface,
+      which uses iter_records instead). """
+      try:
+         size = os.path.getsize(path)
+         ranges = self._split(path, size, range_size, start)
+      except (IOError, OSError) as e:
+         logging.error("I/O error %d: %s" % (e.errno, e.strerror))
+         return
+      if(processes is None):
+         processes = multiprocessing.cpu_count()
+      if(processes <= 1 or len(ranges) <= 1):
+         # It is not worth starting any worker processes.
+         for record in self.iter_records(path, start=start, positions=positions):
+            yield record
+         return
+
+      logging.debug("Reading in ADIF file with path %s, in %d parts, using %d processes..." % (path, len(ranges), processes))
+      pool = multiprocessing.Pool(processes)
+      try:
+         pending = deque()
+         ranges = iter(ranges)
+         while True:
+            # Keep every worker busy, but don't parse too far ahead of the records that have been yielded.
+            while(len(pending) < 2*processes):
+               try:
+                  (start, end) = next(ranges)
+               except StopIteration:
+                  break
+               pending.append((end, pool.apply_async(_parse_range, [(path, start, end)])))
+            if(len(pending) == 0):
+               break
+            (end, result) = pending.popleft()
+            (records, position) = result.get()
+            for (record, record_position) in records:
+               if(positions):
+                  yield (record, record_position)
+               else:
+                  yield record
+            if(position != end and end != size):
+               # The scan of the range did not finish at the range's end. This can only happen if the <eor> marker that the range was split at
+               # is actually part of some field data, in which case the ranges after it are not aligned with the records. Carry on with the rest of the file
+               # from the end of the last complete record instead.
+               logging.warning("An <eor> marker was found in some field data at position %d. Reading the rest of the file serially..." % end)
+               for record in self.iter_records(path, start=position, positions=positions):
+                  yield record
+               break
+      finally:
+         pool.terminate()
+         pool.join()
+
+      logging.debug("Finished reading the ADIF file.")
+      return
+
+   def _split(self, path, size, range_size, start=0):
+      """ Split the file with a given path and size (in bytes), from the position 'start' onwards, into a list of (start, end) byte ranges
+      of about 'range_size' bytes each. Every range except the last one ends just after an <eor> marker. """
+      ranges = []
+      f = open(path, 'rb')
+      try:
+         while(start < size):
+            # Find the first <eor> marker after the target end of the range. The marker may be in upper or lower case.
+            f.seek(start + range_size)
+            offset = start + range_size
+            end = size
+            window = ""
+            while True:
+               data = f.read(CHUNK_SIZE)
+               if(data == ""):
+                  break
+               window = window[-4:] + data # Keep the end of the previous block in case the marker straddles two blocks.
+               marker = window.lower().find("<eor>")
+               if(marker != -1):
+                  end = offset - (len(window) - len(data)) + marker + 5
+                  break
+               offset = offset + len(data)
+            ranges.append((start, end))
+            start = end
+      finally:
+         f.close()
+      return ranges
+
    def _parse_adi(self, text):
       """ Parse some raw text (defined in the 'text' argument) for ADIF field data.
       Outputs a list of dictionaries (one dictionary per QSO). Each dictionary contains the field-value pairs,
@@ -132,100 +384,143 @@ class ADIF:
       logging.debug("Parsing text from the ADIF file...")
 
       records = []
-
-      # Separate the text at the <eor> or <eoh> markers.
-      tokens = re.split('(<eor>|<eoh>)', text, flags=re.IGNORECASE)
-      tokens.pop() # Anything after the final <eor> marker should be ignored.
-      
-      # The header might tell us the number of records, but let's not assume
-      # this and simply ignore it instead (if it exists).
-      if(re.search('<eoh>', text, flags=re.IGNORECASE) is not None):
-         # There is a header present, so let's ignore everything
-         # up to and including the <eoh> marker. Note that
-         # re.search has been used here to handle any case sensitivity.
-         # Previously we were checking for <eoh>. <EOH> is also valid
-         # but wasn't been detected before.
-         while len(tokens) > 0:
-            t = tokens.pop(0)
-            if(re.match('<eoh>', t, flags=re.IGNORECASE) is not None):
-               break
-            
-      n_eor = 0 
-      n_record = 0
-      records = []
-      for t in tokens:
-         if(re.match('<eor>', t, flags=re.IGNORECASE) is not None):
-            n_eor = n_eor + 1
-            continue
-         else:
-            n_record = n_record + 1
-            # Each record will have field names and corresponding
-            # data entries. Store this in a dictionary.
-            # Note: This is based on the code written by OK4BX.
-            # (http://web.bxhome.org/blog/ok4bx/2012/05/adif-parser-python)
-            fields_and_data_dictionary = {}
-            fields_and_data = re.findall('<(.*?):(\d*).*?>([^<\t\n\r\f\v\Z]+)', t)  
-            for fd in fields_and_data:
-               # Let's force all field names to be in upper case.
-               # This will help us later when comparing the field names
-               # against the available field names in the ADIF specification.
-               field_name = fd[0].upper()
-               field_data = fd[2][:int(fd[1])]
-
-               # Combo boxes are used later on and these are case sensitive,
-               # so adjust the field data accordingly.
-               if(field_name == "BAND"):
-                  field_data = field_data.lower()
-               elif(field_name == "MODE"):
-                  field_data = field_data.upper()
-               elif(field_name == "CALL"):
-                  # Also force all the callsigns to be in upper case.
-                  field_data = field_data.upper()
-
-               if(field_name in AVAILABLE_FIELD_NAMES_ORDERED):
-                  field_data_type = AVAILABLE_FIELD_NAMES_TYPES[field_name]
-                  if(self.is_valid(field_name, field_data, field_data_type)):
-                     # Only add the field if it is a standard ADIF field and it holds valid data.
-                     fields_and_data_dictionary[field_name] = field_data
-
-            records.append(fields_and_data_dictionary)
-      
-      assert n_eor == n_record
+      for (fields, position) in self._scan(text):
+         records.append(self._clean_record(fields))
 
       logging.debug("Finished parsing text.")
       
       return records
 
-      
+   def _scan(self, text, position=0, end=None):
+      """ Scan the raw text (defined in the 'text' argument, which may be a string or a memory-mapped file) for ADIF field data in a single left-to-right pass, starting at 'position'
+      and stopping at 'end' (or at the end of the text if 'end' is None). After each <field:len> tag, the scanner jumps forward by the declared length,
+      so the field data may contain any character (including '<' and new line characters).
+
+      This is a generator which yields a tuple for each complete record (i.e. one terminated by an <eor> marker). The tuple contains a dictionary of
+      the record's raw field-value pairs (with the field names in upper case) and the position in the text just after the record's <eor> marker.
+      Anything before an <eoh> marker is treated as the header and ignored. Scanning stops at the first incomplete tag or field,
+      so a partial record at the end of the text is never yielded. """
+      if(end is None):
+         end = len(text)
+      find = text.find
+      # The same few tags (e.g. <call:6>) appear over and over again in a file, so the field name and length of each tag are only worked out once.
+      tags = {}
+      fields = {}
+      while True:
+         tag_start = find("<", position, end)
+         if(tag_start == -1):
+            return
+         tag_end = find(">", tag_start, end)
+         if(tag_end == -1):
+            return
+         tag = text[tag_start+1:tag_end]
+         try:
+            (field_name, length) = tags[tag]
+         except KeyError:
+            (field_name, length) = self._parse_tag(tag)
+            if(len(tags) < MAX_CACHED_TAGS):
+               tags[tag] = (field_name, length)
+         position = tag_end + 1
+
+         if(length is None):
+            # No length has been specified, so this should be an <eor> or <eoh> marker.
+            if(field_name == "EOR"):
+               yield (fields, position)
+               fields = {}
+            elif(field_name == "EOH"):
+               # The header might tell us the number of records, but let's not assume
+               # this and simply ignore it instead.
+               fields = {}
+            continue
+
+         position = position + length
+         if(position > end):
+            # The field data has been cut off.
+            return
+         fields[field_name] = text[tag_end+1:position]
+
+   def _parse_tag(self, tag):
+      """ Given the text inside a tag (i.e. between the '<' and '>'), e.g. "call:6" or "qso_date:8:d", return a tuple containing the field name and the length of the field data.
+      The length is None if no length has been specified (e.g. for an <eor> marker). """
+      parts = tag.split(":")
+      # Let's force all field names to be in upper case.
+      # This will help us later when comparing the field names
+      # against the available field names in the ADIF specification.
+      field_name = parts[0].upper()
+      if(len(parts) == 1):
+         return (field_name, None)
+      # The tag is of the form <field_name:length> or <field_name:length:data_type>.
+      try:
+         length = int(parts[1])
+      except ValueError:
+         length = 0
+      return (field_name, length)
+
+   def _clean_record(self, fields):
+      """ Given a dictionary of raw field-value pairs for a single record (as produced by the _scan method), return a dictionary containing
+      only the standard ADIF fields that hold valid data, e.g. {FREQ:145.500, BAND:2M, MODE:FM}. """
+      fields_and_data_dictionary = {}
+      for (field_name, field_data) in fields.iteritems():
+         validator = FIELD_VALIDATORS.get(field_name)
+         if(validator is None):
+            continue # Not a standard ADIF field.
+
+         # Combo boxes are used later on and these are case sensitive,
+         # so adjust the field data accordingly.
+         if(field_name == "BAND"):
+            field_data = field_data.lower()
+         elif(field_name == "MODE"):
+            field_data = field_data.upper()
+         elif(field_name == "CALL"):
+            # Also force all the callsigns to be in upper case.
+            field_data = field_data.upper()
+
+         # Only add the field if it is a standard ADIF field and it holds valid data (or no data at all).
+         if(field_data == "" or validator(field_data)):
+            fields_and_data_dictionary[field_name] = field_data
+
+      return fields_and_data_dictionary
+
    def write(self, records, path):
-      """ Write an ADIF file containing all the QSOs in the 'records' list. The desired path is specified in the 'path' argument. 
+      """ Write an ADIF file containing all the QSOs in 'records', which can be any iterable of records (e.g. a list, or a database cursor returned by Log.query).
+      The records are written out one at a time as they are iterated over, so they never all need to be held in memory. The desired path is specified in the 'path' argument. 
       This method returns None. """
    
       logging.debug("Writing records to an ADIF file...")
       try:
-         f = open(path, 'w') # Open file for writing
+         f = open(path, 'w', WRITE_BUFFER_SIZE) # Open file for writing. The output is buffered so that it is written to the disk in large chunks.
          
          # First write a header containing program version, number of records, etc.
+         # Note: The number of records is only known in advance if 'records' is a list (or similar).
          dt = datetime.now()
+         if(hasattr(records, "__len__")):
+            contents = " Contains %d record(s)." % len(records)
+         else:
+            contents = ""
          
-         f.write("""Amateur radio log file. Generated on %s. Contains %d record(s). 
+         f.write("""Amateur radio log file. Generated on %s.%s 
          
 <adif_ver:%d>%s
 <programid:5>PyQSO
 <programversion:8>0.2a-dev
-<eoh>\n""" % (dt, len(records), len(str(ADIF_VERSION)), ADIF_VERSION))
+<eoh>\n""" % (dt, contents, len(str(ADIF_VERSION)), ADIF_VERSION))
          
          # Then write each log to the file.
+         keys = None
          for r in records:
-            for field_name in AVAILABLE_FIELD_NAMES_ORDERED:
-               if(not(field_name.lower() in r.keys() or field_name.upper() in r.keys())): 
-                  # If the field_name does not exist in the record, then skip past it.
-                  # Only write out the fields that exist and that have some data in them.
-                  continue
-               else:
-                  if( (r[field_name] != "NULL") and (r[field_name] != "") ):
-                     f.write("<%s:%d>%s\n" % (field_name.lower(), len(r[field_name]), r[field_name]))
-            f.write("<eor>\n")
+            if(keys is None or isinstance(r, dict)):
+               # Work out which of the fields exist in the record, and the key used for each of them (e.g. "CALL" or "call").
+               # Every row from a database cursor has the same columns, so this only needs to be done once. Each dictionary may have different keys though.
+               available_keys = dict([(key.upper(), key) for key in r.keys()])
+               keys = [(field_name.lower(), available_keys[field_name]) for field_name in AVAILABLE_FIELD_NAMES_ORDERED if field_name in available_keys]
+            lines = []
+            for (field_name, key) in keys:
+               data = r[key]
+               # Only write out the fields that have some data in them.
+               if((data is not None) and (data != "NULL") and (data != "")):
+                  lines.append("<%s:%d>%s\n" % (field_name, len(data), data))
+            lines.append("<eor>\n")
+            f.write("".join(lines))
 
          logging.debug("Finished writing records to the ADIF file.")
          f.close()
@@ -241,157 +536,25 @@ class ADIF:
    def is_valid(self, field_name, data, data_type):
       """ Validate the data in a field (with name 'field_name') with respect to the ADIF specification. 
       This method returns either True or False to indicate whether the data is valid or not. """
-
-      logging.debug("Validating the following data in field '%s': %s" % (field_name, data))
-
       # Allow an empty string, in case the user doesn't want
       # to fill in this field.
       if(data == ""):
          return True
-
-      if(data_type == "N"):
-         # Allow a decimal point before and/or after any numbers,
-         # but don't allow a decimal point on its own.
-         m = re.match(r"-?(([0-9]+\.?[0-9]*)|([0-9]*\.?[0-9]+))", data)
-         if(m is None):
-            # Did not match anything.
-            return False
-         else:
-            # Make sure we match the whole string,
-            # otherwise there may be an invalid character after the match. 
-            return (m.group(0) == data)
-      
-      elif(data_type == "B"):
-         # Boolean
-         m = re.match(r"(Y|N)", data)
-         if(m is None):
-            return False
-         else:
-            return (m.group(0) == data)
-
-      elif(data_type == "D"):
-         # Date
-         pattern = re.compile(r"([0-9]{4})")
-         m_year = pattern.match(data, 0)
-         if((m_year is None) or (int(m_year.group(0)) < 1930)):
-            # Did not match anything.
-            return False
-         else:
-            pattern = re.compile(r"([0-9]{2})")
-            m_month = pattern.match(data, 4)
-            if((m_month is None) or int(m_month.group(0)) > 12 or int(m_month.group(0)) < 1):
-               # Did not match anything.
-               return False
-            else:
-               pattern = re.compile(r"([0-9]{2})")
-               m_day = pattern.match(data, 6)
-               days_in_month = calendar.monthrange(int(m_year.group(0)), int(m_month.group(0)))
-               if((m_day is None) or int(m_day.group(0)) > days_in_month[1] or int(m_day.group(0)) < 1):
-                  # Did not match anything.
-                  return False
-               else:
-                  # Make sure we match the whole string,
-                  # otherwise there may be an invalid character after the match. 
-                  return (len(data) == 8)
-
-      elif(data_type == "T"):
-         # Time
-         pattern = re.compile(r"([0-9]{2})")
-         m_hour = pattern.match(data, 0)
-         if((m_hour is None) or (int(m_hour.group(0)) < 0) or (int(m_hour.group(0)) > 23)):
-            # Did not match anything.
-            return False
-         else:
-            pattern = re.compile(r"([0-9]{2})")
-            m_minutes = pattern.match(data, 2)
-            if((m_minutes is None) or int(m_minutes.group(0)) < 0 or int(m_minutes.group(0)) > 59):
-               # Did not match anything.
-               return False
-            else:
-               if(len(data) == 4):
-                  # HHMM format
-                  return True
-               pattern = re.compile(r"([0-9]{2})")
-               m_seconds = pattern.match(data, 4)
-               if((m_seconds is None) or int(m_seconds.group(0)) < 0 or int(m_seconds.group(0)) > 59):
-                  # Did not match anything.
-                  return False
-               else:
-                  # Make sure we match the whole string,
-                  # otherwise there may be an invalid character after the match. 
-                  return (len(data) == 6) # HHMMSS format
-
-      #FIXME: Need to make sure that the "S" and "M" data types accept ASCII-only characters
-      # in the range 32-126 inclusive.
-      elif(data_type == "S"):
-         # String
-         m = re.match(r"(.+)", data)
-         if(m is None):
-            return False
-         else:
-            return (m.group(0) == data)
-
-      elif(data_type == "I"):
-         # IntlString
-         m = re.match(ur"(.+)", data, re.UNICODE)
-         if(m is None):
-            return False
-         else:
-            return (m.group(0) == data)
-
-      elif(data_type == "G"):
-         # IntlMultilineString
-         m = re.match(ur"(.+(\r\n)*.*)", data, re.UNICODE)
-         if(m is None):
-            return False
-         else:
-            return (m.group(0) == data)
-
-      elif(data_type == "M"):
-         # MultilineString
-         #m = re.match(r"(.+(\r\n)*.*)", data)
-         #if(m is None):
-         #   return False
-         #else:
-         #   return (m.group(0) == data)
-         return True
-
-      elif(data_type == "L"):
-         # Location
-         pattern = re.compile(r"([EWNS]{1})", re.IGNORECASE)
-         m_directional = pattern.match(data, 0)
-         if(m_directional is None):
-            # Did not match anything.
-            return False
-         else:
-            pattern = re.compile(r"([0-9]{3})")
-            m_degrees = pattern.match(data, 1)
-            if((m_degrees is None) or int(m_degrees.group(0)) < 0 or int(m_degrees.group(0)) > 180):
-               # Did not match anything.
-               return False
-            else:
-               pattern = re.compile(r"([0-9]{2}\.[0-9]{3})")
-               m_minutes = pattern.match(data, 4)
-               if((m_minutes is None) or float(m_minutes.group(0)) < 0 or float(m_minutes.group(0)) > 59.999):
-                  # Did not match anything.
-                  return False
-               else:
-                  # Make sure we match the whole string,
-                  # otherwise there may be an invalid character after the match. 
-                  return (len(data) == 10)
-
-
-      elif(data_type == "E" or data_type == "A"):
-         # Enumeration, AwardList.
-         if(field_name == "MODE"):
-            return (data in MODES)
-         elif(field_name == "BAND"):
-            return (data in BANDS)
-         else:
-            return True
-
+      if(AVAILABLE_FIELD_NAMES_TYPES.get(field_name) == data_type):
+         validator = FIELD_VALIDATORS[field_name]
       else:
-         return True
+         validator = get_validator(field_name, data_type)
+      return validator(data)
+
+   def validate_record(self, record):
+      """ Validate the data in all the standard ADIF fields of a record (a dictionary of field-value pairs) in one go.
+      Return a list of the names of the fields which hold invalid data, in the order given by AVAILABLE_FIELD_NAMES_ORDERED. The list is empty if all the data is valid. """
+      invalid_field_names = []
+      for field_name in AVAILABLE_FIELD_NAMES_ORDERED:
+         data = record.get(field_name)
+         if(data and not FIELD_VALIDATORS[field_name](data)):
+            invalid_field_names.append(field_name)
+      return invalid_field_names
       
    
 class TestADIF(unittest.TestCase):
@@ -415,6 +578,80 @@ class TestADIF(unittest.TestCase):
       assert(len(records[0].keys()) == len(expected_records[0].keys()))
       assert(records == expected_records)
 
+   def test_adif_iter_records(self):
+      text = """Some test ADI data.<eoh>
+
+<call:4>TEST<band:3>40m<mode:2>CW
+<qso_date:8:d>20130322<time_on:4>1955<eor>
+<call:7>TEST456<band:2>2m<mode:2>FM
+<qso_date:8:d>20130312<time_on:4>0101<EOR>
+<call:5>TRAIL"""
+      f = open("ADIF.test_read.adi", 'w')
+      f.write(text)
+      f.close()
+
+      # Use a tiny chunk size so that the field tags and <eor> markers are split across chunk boundaries.
+      records = list(self.adif.iter_records("ADIF.test_read.adi", chunk_size=5, use_mmap=False))
+      expected_records = [{'TIME_ON': '1955', 'BAND': '40m', 'CALL': 'TEST', 'MODE': 'CW', 'QSO_DATE': '20130322'},
+                          {'TIME_ON': '0101', 'BAND': '2m', 'CALL': 'TEST456', 'MODE': 'FM', 'QSO_DATE': '20130312'}]
+      print "Imported records: ", records
+      print "Expected records: ", expected_records
+      assert(records == expected_records)
+      assert(records == self.adif.read("ADIF.test_read.adi"))
+      # Reading from a memory-mapped file, with or without a start position, should give the same records.
+      assert(list(self.adif.iter_records("ADIF.test_read.adi")) == expected_records)
+      start = text.index("<eor>") + len("<eor>") # Just after the first record.
+      assert(list(self.adif.iter_records("ADIF.test_read.adi", start=start)) == expected_records[1:])
+      # The positions returned by a first pass should give the same start position.
+      records_and_positions = list(self.adif.iter_records("ADIF.test_read.adi", positions=True))
+      assert(records_and_positions[0][1] == start)
+
+      # Empty files cannot be memory-mapped, so they should be read in chunks instead.
+      open("ADIF.test_read.adi", 'w').close()
+      assert(list(self.adif.iter_records("ADIF.test_read.adi")) == [])
+
+   def test_adif_iter_records_parallel(self):
+      f = open("ADIF.test_read.adi", 'w')
+      f.write("Some test ADI data.<eoh>\n")
+      for i in range(0, 50):
+         f.write("<call:6>TEST%02d<band:3>40m<mode:2>CW<qso_date:8:d>20130322<time_on:4>1955<eor>\n" % i)
+      # An <eor> marker in some field data should not confuse the splitting of the file.
+      f.write("<call:4>TEST<notes:14>Not an <EOR>!!<eor>\n")
+      for i in range(50, 100):
+         f.write("<CALL:6>TEST%02d<BAND:3>20M<MODE:3>SSB<EOR>\n" % i)
+      f.write("<call:5>TRAIL")
+      f.close()
+
+      expected_records = self.adif.read("ADIF.test_read.adi")
+      assert(len(expected_records) == 101)
+      # Use a tiny range size so that the file is split into lots of ranges.
+      for range_size in [1, 100, 1000]:
+         records = list(self.adif.iter_records_parallel("ADIF.test_read.adi", processes=2, range_size=range_size))
+         print "Number of records imported with a range size of %d: %d" % (range_size, len(records))
+         assert(records == expected_records)
+
+      # The positions should be the same however the file is read, and reading from any of them should give the rest of the records.
+      records_and_positions = list(self.adif.iter_records("ADIF.test_read.adi", positions=True))
+      assert([record for (record, position) in records_and_positions] == expected_records)
+      assert(list(self.adif.iter_records("ADIF.test_read.adi", chunk_size=7, use_mmap=False, positions=True)) == records_and_positions)
+      assert(list(self.adif.iter_records_parallel("ADIF.test_read.adi", processes=2, range_size=100, positions=True)) == records_and_positions)
+      position = records_and_positions[60][1]
+      assert(list(self.adif.iter_records_parallel("ADIF.test_read.adi", processes=2, range_size=100, start=position)) == expected_records[61:])
+
+   def test_adif_read_length_driven(self):
+      f = open("ADIF.test_read.adi", 'w')
+      f.write("""<adif_ver:3>1.0<EOH>
+<CALL:4>TEST<NOTES:22>Line one <b>
+Line two.<QSO_DATE:8>20130322 <eor>""")
+      f.close()
+
+      # The field data may contain '<' and new line characters, since the scanner jumps forward by the declared length of each field.
+      records = self.adif.read("ADIF.test_read.adi")
+      expected_records = [{'CALL': 'TEST', 'NOTES': 'Line one <b>\nLine two.', 'QSO_DATE': '20130322'}]
+      print "Imported records: ", records
+      print "Expected records: ", expected_records
+      assert(records == expected_records)
+
    def test_adif_write(self):
       records = [{"CALL":"TEST123", "QSO_DATE":"20120402", "TIME_ON":"1234", "FREQ":"145.500", "BAND":"2m", "MODE":"FM", "RST_SENT":"59", "RST_RCVD":"59"},
                  {"CALL":"TEST123", "QSO_DATE":"20130312", "TIME_ON":"0101", "FREQ":"145.750", "BAND":"2m", "MODE":"FM"}]
@@ -488,11 +725,62 @@ class TestADIF(unittest.TestCase):
 
       self.connection.close()
 
+   def test_adif_write_iterator(self):
+      import sqlite3
+      self.connection = sqlite3.connect("./unittest_resources/test.db")
+      self.connection.row_factory = sqlite3.Row
+
+      c = self.connection.cursor()
+      c.execute("SELECT * FROM test")
+      self.adif.write(c, "ADIF.test_write_iterator.adi") # Write the records straight from the cursor.
+
+      f = open("ADIF.test_write_iterator.adi", 'r')
+      text = f.read()
+      print "File 'ADIF.test_write_iterator.adi' contains the following text:", text
+      assert("record(s)" not in text) # The number of records is not known in advance.
+      assert("""<eoh>
+<call:7>TEST123
+<qso_date:8>20120402
+<time_on:4>1234
+<freq:7>145.500
+<band:2>2m
+<mode:2>FM
+<rst_sent:2>59
+<rst_rcvd:2>59
+<eor>
+<call:7>TEST456
+<qso_date:8>20130312
+<time_on:4>0101
+<freq:7>145.750
+<band:2>2m
+<mode:2>FM
+<eor>
+""" in text)
+      f.close()
+
+      self.connection.close()
+
    def test_adif_is_valid(self):
       assert(self.adif.is_valid("CALL", "TEST123", "S") == True)
       assert(self.adif.is_valid("QSO_DATE", "20120402", "D") == True)
       assert(self.adif.is_valid("TIME_ON", "1230", "T") == True)
       assert(self.adif.is_valid("TX_PWR", "5", "N") == True)
+      assert(self.adif.is_valid("TX_PWR", "5.", "N") == True)
+      assert(self.adif.is_valid("TX_PWR", ".", "N") == False)
+      assert(self.adif.is_valid("QSO_DATE", "20130229", "D") == False)
+      assert(self.adif.is_valid("QSO_DATE", "19290101", "D") == False)
+      assert(self.adif.is_valid("TIME_ON", "123059", "T") == True)
+      assert(self.adif.is_valid("TIME_ON", "2400", "T") == False)
+      assert(self.adif.is_valid("BAND", "40m", "E") == True)
+      assert(self.adif.is_valid("BAND", "40M", "E") == False)
+      assert(self.adif.is_valid("MODE", "NOTAMODE", "E") == False)
+      assert(self.adif.is_valid("NOTES", "Line 1\nLine 2", "M") == True)
+      assert(self.adif.is_valid("CALL", "", "S") == True)
+
+   def test_adif_validate_record(self):
+      record = {"CALL":"TEST123", "QSO_DATE":"20121332", "TIME_ON":"1230", "FREQ":"14.0a", "BAND":"20m", "MODE":"", "UNKNOWN":"Ignored"}
+      assert(self.adif.validate_record(record) == ["QSO_DATE", "FREQ"])
+      assert(self.adif.validate_record({"CALL":"TEST123", "BAND":"20m"}) == [])
 
 if(__name__ == '__main__'):
    unittest.main()
@@ -20,9 +20,20 @@
 
 from gi.repository import Gtk, GObject
 import logging
+import unittest
+import sqlite3 as sqlite
+
+from pyqso.adif import BANDS, MODES
+from pyqso.log import Log, get_create_table_query
 
 class Awards(Gtk.VBox):
-   """ A tool for tracking progress towards an award. Currently this only supports the DXCC award. For more information visit http://www.arrl.org/dxcc """
+   """ A tool for tracking progress towards an award. Currently this only supports the DXCC award. For more information visit http://www.arrl.org/dxcc
+
+   The Awards object also keeps an in-memory index of the callsign/band/mode combinations and DXCC entity/band/mode category combinations that have been worked,
+   so that other tools (e.g. the DX cluster) can find out whether a station has been worked before without querying the logbook. """
+
+   # Emitted whenever the index of worked stations changes.
+   __gsignals__ = {"worked-index-changed": (GObject.SignalFlags.RUN_FIRST, None, ())}
    
    def __init__(self, parent):
       """ Set up a table for progress tracking purposes. """
@@ -70,36 +81,215 @@ class Awards(Gtk.VBox):
       return
 
    def count(self):
-      """ Update the table for progress tracking. """
+      """ Update the table for progress tracking by counting every record in the logbook from scratch.
+      This only needs to be done when a logbook is opened, or when many records change at once (e.g. when a log is imported or deleted).
+      Changes to individual records should be applied with the on_record_added, on_record_changed and on_record_deleted methods instead. """
       logging.debug("Counting the band/mode combinations for the awards table...")
       # Wipe everything and start again
       self.awards.clear()
       # For each mode, add a new list for holding the totals, and initialise the values to zero.
-      count = []
-      for i in range(0, len(self.bands)):
-         count.append([0]*len(self.bands))
+      self.totals = []
+      for i in range(0, len(self.modes)):
+         self.totals.append([0]*len(self.bands))
+      # The number of records for each band/mode combination that each callsign has been worked on, keyed by callsign.
+      # Each band/mode combination is stored as a single integer (see _get_slot) to keep the index compact.
+      self.worked_calls = {}
+      # The number of records for each (DXCC entity, band, mode category) combination. The "Mixed" category counts the records in every mode.
+      self.worked_entities = {}
+      # The DXCC entity of each callsign that has been worked (if it is known).
+      self.dxcc = {}
 
       for log in self.parent.logbook.logs:
-         records = log.get_all_records()
-         if(records is not None):
-            for r in records:
-               if(r["BAND"] is not None and r["MODE"] is not None):
-                  if(r["BAND"].lower() in self.bands and r["MODE"] != ""):
-                     band = self.bands.index(r["BAND"].lower())
-                     # Phone modes
-                     if(r["MODE"].upper() in ["FM", "AM", "SSB", "SSTV"]):
-                        count[0][band] += 1
-                     elif(r["MODE"].upper() == "CW"):
-                        count[1][band] += 1
-                     else: 
-                        #FIXME: This assumes that all the other modes in the ADIF list are digital modes. Is this the case?
-                        count[2][band] += 1
-                     count[3][band] += 1 # Keep the total of each column in the "Mixed" mode
+         # Let the database do the counting. This leaves only the distinct callsign/band/mode/DXCC combinations to sort into the table and the index.
+         worked_counts = log.get_worked_counts()
+         if(worked_counts is not None):
+            for (call, band, mode, dxcc, n) in worked_counts:
+               if(band in self.bands):
+                  band_index = self.bands.index(band)
+                  self.totals[self._get_mode_index(mode)][band_index] += n
+                  self.totals[3][band_index] += n # Keep the total of each column in the "Mixed" mode
+               self._update_index(call, band, mode, dxcc, n)
          else:
             logging.error("Could not update the awards table for '%s' because of a database error." % log.name)
       # Insert the rows containing the totals
       for i in range(0, len(self.modes)):
-         self.awards.append([self.modes[i]] + count[i])
+         self.awards.append([self.modes[i]] + self.totals[i])
       logging.debug("Awards table updated.") 
+      self.emit("worked-index-changed")
+      return
+
+   def on_record_added(self, record):
+      """ Update the table for progress tracking after a new record has been added to the logbook. """
+      self._update(record, 1)
+      return
+
+   def on_record_changed(self, old_record, new_record):
+      """ Update the table for progress tracking after a record in the logbook has been edited. """
+      self._update(old_record, -1)
+      self._update(new_record, 1)
+      return
+
+   def on_record_deleted(self, record):
+      """ Update the table for progress tracking after a record has been deleted from the logbook. """
+      self._update(record, -1)
+      return
+
+   def _update(self, record, delta):
+      """ Add 'delta' to the totals for the band/mode combination of a given record (if the record counts towards the award), and to the index of worked stations. """
+      band = record["BAND"]
+      mode = record["MODE"]
+      if(band is None or mode is None or mode == ""):
+         return
+      self._update_index(record["CALL"], band.lower(), mode.upper(), record["DXCC"], delta)
+      self.emit("worked-index-changed")
+
+      cell = self._get_cell(record)
+      if(cell is None):
+         return
+      (mode_index, band_index) = cell
+      # Update the total for the record's mode, as well as the total in the "Mixed" mode.
+      for i in [mode_index, 3]:
+         self.totals[i][band_index] += delta
+         self.awards.set_value(self.awards.get_iter(Gtk.TreePath(i)), band_index+1, self.totals[i][band_index])
+      return
+
+   def _update_index(self, call, band, mode, dxcc, delta):
+      """ Add 'delta' to the number of records for a given callsign, band (in lower case), mode (in upper case) and DXCC entity in the index of worked stations. """
+      slot = self._get_slot(band, mode)
+      if(slot is None):
+         return
+      if(call):
+         call = call.upper()
+         slots = self.worked_calls.setdefault(call, {})
+         n = slots.get(slot, 0) + delta
+         if(n > 0):
+            slots[slot] = n
+         else:
+            slots.pop(slot, None)
+            if(len(slots) == 0):
+               del self.worked_calls[call]
+         if(dxcc):
+            self.dxcc[call] = str(dxcc)
+      if(dxcc):
+         for category in [self._get_mode_index(mode), 3]:
+            key = (str(dxcc), band, category)
+            n = self.worked_entities.get(key, 0) + delta
+            if(n > 0):
+               self.worked_entities[key] = n
+            else:
+               self.worked_entities.pop(key, None)
       return
 
+   def _get_slot(self, band, mode):
+      """ Return a single integer which identifies a band (in lower case) and mode (in upper case) from the ADIF specification, or None if either is not recognised. """
+      try:
+         return BANDS.index(band)*len(MODES) + MODES.index(mode)
+      except ValueError:
+         return None
+
+   def is_worked(self, call, band, mode=None):
+      """ Return True if a callsign has been worked on a given band and mode (or in any mode on the band, if 'mode' is None), and False otherwise. """
+      slots = self.worked_calls.get(call.upper())
+      if(slots is None):
+         return False
+      if(mode is not None):
+         return (self._get_slot(band, mode.upper()) in slots)
+      band_slot = self._get_slot(band, "")
+      if(band_slot is None):
+         return False
+      # Each band's slots are consecutive, starting with the empty mode.
+      for slot in slots:
+         if(band_slot <= slot < band_slot + len(MODES)):
+            return True
+      return False
+
+   def is_needed(self, call, band, mode=None):
+      """ Return True if working a callsign on a given band and mode would count towards a new DXCC entity/band/mode category combination in the awards table,
+      False if it would not, or None if the callsign's DXCC entity is not known (i.e. it has not been worked with a DXCC entity recorded).
+      If 'mode' is None, then the "Mixed" category is checked instead. """
+      dxcc = self.dxcc.get(call.upper())
+      if(dxcc is None):
+         return None
+      category = 3 if mode is None else self._get_mode_index(mode.upper())
+      return ((dxcc, band, category) not in self.worked_entities)
+
+   def get_spot_status(self, call, band, mode=None):
+      """ Return a short description of whether a spotted station is worth working: "Worked" if it has been worked before on the band (and mode, if known),
+      "Needed" if it would count towards a new slot in the awards table, or an empty string otherwise. """
+      if(self.is_worked(call, band, mode)):
+         return "Worked"
+      elif(self.is_needed(call, band, mode)):
+         return "Needed"
+      return ""
+
+   def _get_cell(self, record):
+      """ Return a tuple containing the index of the mode category (in self.modes) and the index of the band (in self.bands) that a record counts towards.
+      The record can be a dictionary of field-value pairs or a row from the database. Return None if the record does not count towards the award. """
+      band = record["BAND"]
+      mode = record["MODE"]
+      if(band is None or mode is None or mode == ""):
+         return None
+      band = band.lower()
+      if(not(band in self.bands)):
+         return None
+      return (self._get_mode_index(mode.upper()), self.bands.index(band))
+
+   def _get_mode_index(self, mode):
+      """ Return the index (in self.modes) of the category that a given mode belongs to: Phone, CW or Digital. """
+      # Phone modes
+      if(mode in ["FM", "AM", "SSB", "SSTV"]):
+         return 0
+      elif(mode == "CW"):
+         return 1
+      else: 
+         #FIXME: This assumes that all the other modes in the ADIF list are digital modes. Is this the case?
+         return 2
+
+class TestAwards(unittest.TestCase):
+
+   class Parent:
+      """ Stands in for the main window, which gives the Awards access to the logbook. """
+      def __init__(self, logs):
+         self.logbook = self
+         self.logs = logs
+
+   def setUp(self):
+      self.connection = sqlite.connect(":memory:")
+      self.connection.row_factory = sqlite.Row
+      self.connection.execute(get_create_table_query("test"))
+      self.log = Log(self.connection, "test")
+      self.log.add_record({"CALL":"TEST123", "BAND":"20m", "MODE":"CW", "DXCC":"223"})
+      self.log.add_record({"CALL":"M0ABC", "BAND":"40m", "MODE":"SSB", "DXCC":"223"})
+      self.awards = Awards(self.Parent([self.log]))
+
+   def tearDown(self):
+      self.connection.close()
+
+   def test_awards_is_worked(self):
+      assert(self.awards.is_worked("test123", "20m", "CW"))
+      assert(self.awards.is_worked("TEST123", "20m"))
+      assert(not self.awards.is_worked("TEST123", "20m", "SSB"))
+      assert(not self.awards.is_worked("TEST123", "40m"))
+      assert(not self.awards.is_worked("G4ABC", "20m"))
+
+      record = {"CALL":"TEST123", "BAND":"40m", "MODE":"FM", "DXCC":"223"}
+      self.awards.on_record_added(record)
+      assert(self.awards.is_worked("TEST123", "40m"))
+      self.awards.on_record_deleted(record)
+      assert(not self.awards.is_worked("TEST123", "40m"))
+
+   def test_awards_is_needed(self):
+      assert(self.awards.is_needed("TEST123", "20m", "CW") == False)
+      # M0ABC is in the same DXCC entity, which has only been worked in CW on 20m.
+      assert(self.awards.is_needed("M0ABC", "20m", "CW") == False)
+      assert(self.awards.is_needed("M0ABC", "20m", "SSB") == True)
+      assert(self.awards.is_needed("M0ABC", "20m") == False)
+      assert(self.awards.is_needed("M0ABC", "80m") == True)
+      # The DXCC entity of a callsign that has never been worked is not known.
+      assert(self.awards.is_needed("G4ABC", "20m") is None)
+      assert(self.awards.get_spot_status("TEST123", "20m") == "Worked")
+      assert(self.awards.get_spot_status("M0ABC", "80m") == "Needed")
+      assert(self.awards.get_spot_status("G4ABC", "80m") == "")
+
+if(__name__ == '__main__'):
+   unittest.main()
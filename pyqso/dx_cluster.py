@@ -24,19 +24,74 @@ import os
 import os.path
 import sys
 import telnetlib
+import socket
+import threading
+import re
+import codecs
+import unittest
+from collections import deque
 
+from pyqso.adif import BANDS, BANDS_RANGES, MODES_SET
 from pyqso.telnet_connection_dialog import *
 
+# The delay (in seconds) before the first attempt to reconnect to a DX cluster after the connection has dropped.
+# The delay is doubled after each failed attempt, up to RECONNECT_DELAY_MAX seconds.
+RECONNECT_DELAY_MIN = 2
+RECONNECT_DELAY_MAX = 300
+# The maximum number of spots kept in the spot table. The oldest spot is removed first.
+MAX_SPOTS = 500
+# The maximum number of lines of raw output from the Telnet server kept in the text view. The oldest lines are removed first.
+MAX_OUTPUT_LINES = 1000
+# Matches a DX spot announcement such as "DX de G4ABC:     14025.0  JA1XYZ       CQ CQ                          1234Z",
+# giving the spotter, the frequency (in kHz), the callsign, the comment, and the time (HHMM, UTC). Anything after the time (e.g. a locator) is ignored.
+SPOT_PATTERN = re.compile(r"^\s*DX de\s+([^:\s]+?):?\s+([0-9]+\.?[0-9]*)\s+(\S+)\s+(.*?)\s*([0-9]{4})Z(\s.*)?$", re.IGNORECASE)
+
+def get_band(frequency):
+   """ Return the band (from BANDS) that a frequency (in MHz) lies in, or an empty string if it does not lie in any of them. """
+   for i in range(1, len(BANDS)):
+      if(frequency >= BANDS_RANGES[i][0] and frequency <= BANDS_RANGES[i][1]):
+         return BANDS[i]
+   return ""
+
+def parse_spot(line):
+   """ Parse a line of output from a DX cluster. If the line is a DX spot, return a dictionary containing the spotter's callsign (SPOTTER), the frequency in MHz (FREQ),
+   the band (BAND), the spotted callsign (CALL), the comment (COMMENT), the time in HHMM format (TIME), and the mode (MODE) if the comment mentions one (otherwise None).
+   Otherwise, return None. """
+   m = SPOT_PATTERN.match(line)
+   if(m is None):
+      return None
+   frequency = float(m.group(2))/1000.0 # The frequency is given in kHz.
+   comment = m.group(4)
+   mode = None
+   for word in comment.upper().split():
+      if(word != "" and word in MODES_SET):
+         mode = word
+         break
+   return {"SPOTTER":m.group(1).upper(), "FREQ":frequency, "BAND":get_band(frequency), "CALL":m.group(3).upper(), "COMMENT":comment, "TIME":m.group(5), "MODE":mode}
+
 class DXCluster(Gtk.VBox):
    """ A tool for connecting to a DX cluster (specifically Telnet-based DX clusters). """
    
    def __init__(self, parent):
-      """ Set up the DX cluster's Gtk.VBox, and set up a timer so that PyQSO can retrieve new data from the Telnet server every few seconds. """
+      """ Set up the DX cluster's Gtk.VBox. New data from the Telnet server is retrieved as soon as it arrives (see _on_telnet_io). """
       logging.debug("Setting up the DX cluster...") 
       Gtk.VBox.__init__(self, spacing=2)
 
       self.connection = None
+      self.check_io_event = None # The GObject I/O watch on the connection's socket.
+      # The details of the Telnet server that PyQSO is connected (or connecting) to, so that it can reconnect if the connection drops.
+      self.server = None
+      # Incremented whenever a connection attempt is started or cancelled, so that the result of a cancelled attempt can be ignored.
+      self.attempt = 0
+      self.reconnect_event = None # The GObject timer for the next attempt to reconnect.
+      self.reconnect_delay = RECONNECT_DELAY_MIN
       self.parent = parent
+      # The last line received from the Telnet server, if it has not been completed yet.
+      self.partial_line = ""
+      # Decodes the (UTF-8) data received from the Telnet server. This keeps any incomplete multi-byte character at the end of one read until the next read.
+      self.decoder = codecs.getincrementaldecoder("utf-8")("replace")
+      # The most recent spots (oldest first), along with the iter of each spot's row in the spot table.
+      self.spots = deque()
 
       # Set up the toolbar
       self.toolbar = Gtk.HBox(spacing=2)
@@ -71,6 +126,27 @@ class DXCluster(Gtk.VBox):
 
       self.pack_start(self.toolbar, False, False, 0)
 
+      paned = Gtk.VPaned()
+
+      # A table of the spots received from the DX cluster. The columns are the time, frequency in MHz (as a number, for sorting), frequency (for display),
+      # band, callsign, comment, spotter, and whether the station has been worked before (see Awards.get_spot_status).
+      # The spots can be sorted by clicking on the column headers.
+      self.spot_store = Gtk.ListStore(str, float, str, str, str, str, str, str)
+      treeview = Gtk.TreeView(self.spot_store)
+      treeview.set_grid_lines(Gtk.TreeViewGridLines.BOTH)
+      for (title, display_column, sort_column) in [("Time", 0, 0), ("Frequency", 2, 1), ("Band", 3, 1), ("Callsign", 4, 4), ("Status", 7, 7), ("Comment", 5, 5), ("Spotter", 6, 6)]:
+         renderer = Gtk.CellRendererText()
+         column = Gtk.TreeViewColumn(title, renderer, text=display_column)
+         column.set_resizable(True)
+         column.set_min_width(50)
+         column.set_sort_column_id(sort_column)
+         treeview.append_column(column)
+      sw = Gtk.ScrolledWindow()
+      sw.set_shadow_type(Gtk.ShadowType.ETCHED_IN)
+      sw.set_policy(Gtk.PolicyType.AUTOMATIC, Gtk.PolicyType.AUTOMATIC)
+      sw.add(treeview)
+      paned.pack1(sw, True, True)
+
       # A TextView object to display the output from the Telnet server.
       self.renderer = Gtk.TextView()
       self.renderer.set_editable(False)
@@ -80,7 +156,9 @@ class DXCluster(Gtk.VBox):
       sw.set_policy(Gtk.PolicyType.AUTOMATIC, Gtk.PolicyType.AUTOMATIC)
       sw.add(self.renderer)
       self.buffer = self.renderer.get_buffer()
-      self.pack_start(sw, True, True, 0)
+      paned.pack2(sw, True, True)
+
+      self.pack_start(paned, True, True, 0)
 
       self.set_connect_button_sensitive(True)
 
@@ -91,7 +169,8 @@ class DXCluster(Gtk.VBox):
       return
 
    def telnet_connect(self, widget=None):
-      """ Connect to a user-specified Telnet server, with the host and login details specified in the Gtk.Entry boxes in the TelnetConnectionDialog. """
+      """ Connect to a user-specified Telnet server, with the host and login details specified in the Gtk.Entry boxes in the TelnetConnectionDialog.
+      The connection is made (and the login details sent) in a background thread, so an unreachable or slow server does not freeze the user interface. """
       dialog = TelnetConnectionDialog(self.parent)
       response = dialog.run()
       if(response == Gtk.ResponseType.OK):
@@ -100,6 +179,7 @@ class DXCluster(Gtk.VBox):
          port = connection_info["PORT"].get_text()
          username = connection_info["USERNAME"].get_text()
          password = connection_info["PASSWORD"].get_text()
+         timeout = connection_info["TIMEOUT"].get_text()
          dialog.destroy()
       else:
          dialog.destroy()
@@ -108,39 +188,118 @@ class DXCluster(Gtk.VBox):
       if(host == ""):
          logging.error("No Telnet server specified.")
          return
-      if(port == ""):
-         port = 23 # The default Telnet port
-      else:
-         port = int(port)
+      try:
+         if(port == ""):
+            port = 23 # The default Telnet port
+         else:
+            port = int(port)
+         if(timeout == ""):
+            timeout = DEFAULT_TIMEOUT
+         else:
+            timeout = float(timeout)
+      except ValueError:
+         logging.error("The port and timeout must be numbers.")
+         return
 
+      self.server = {"HOST":host, "PORT":port, "USERNAME":username, "PASSWORD":password, "TIMEOUT":timeout}
+      self.reconnect_delay = RECONNECT_DELAY_MIN
+      self._start_connecting()
+      return
+
+   def _start_connecting(self):
+      """ Start connecting (and logging in) to the Telnet server in self.server, in a background thread. The thread reports back to the main loop
+      by calling _on_connected or _on_connection_failed. """
+      self.attempt = self.attempt + 1
+      self.reconnect_event = None
+      self.set_connect_button_sensitive(False)
+      self._show_status("Connecting to %s:%d..." % (self.server["HOST"], self.server["PORT"]))
+      thread = threading.Thread(target=self._telnet_login, args=(dict(self.server), self.attempt), name="DXClusterConnect")
+      thread.daemon = True
+      thread.start()
+      return
+
+   def _telnet_login(self, server, attempt):
+      """ Connect and log in to a Telnet server, giving up if any step takes longer than the server's timeout. This runs in a background thread. """
       try:
-         self.connection = telnetlib.Telnet(host, port)
-
-         if(username):
-            self.connection.read_until("login: ")
-            self.connection.write(username + "\n")
-         if(password):
-            self.connection.read_until("password: ")
-            self.connection.write(password + "\n")
-      except:
+         connection = telnetlib.Telnet(server["HOST"], server["PORT"], server["TIMEOUT"])
+         if(server["USERNAME"]):
+            self._expect(connection, "login: ", server["TIMEOUT"])
+            connection.write(server["USERNAME"] + "\n")
+         if(server["PASSWORD"]):
+            self._expect(connection, "password: ", server["TIMEOUT"])
+            connection.write(server["PASSWORD"] + "\n")
+      except (socket.error, EOFError, IOError) as e:
          logging.exception("Could not create a connection to the Telnet server")
-         self.connection = None
+         GObject.idle_add(self._on_connection_failed, str(e) or e.__class__.__name__, attempt)
          return
+      GObject.idle_add(self._on_connected, connection, attempt)
+      return
 
-      self.set_connect_button_sensitive(False)
+   def _expect(self, connection, prompt, timeout):
+      """ Wait for the Telnet server to send a given prompt. Raise an IOError if it does not arrive within 'timeout' seconds. """
+      text = connection.read_until(prompt, timeout)
+      if(not text.endswith(prompt)):
+         raise IOError("Timed out waiting for the '%s' prompt." % prompt.strip())
+      return
+
+   def _on_connected(self, connection, attempt):
+      """ Start reading from a newly-established connection, unless the attempt to connect has been cancelled in the meantime. """
+      if(attempt != self.attempt):
+         connection.close()
+         return False
+      self.connection = connection
+      self.reconnect_delay = RECONNECT_DELAY_MIN
+      self.partial_line = ""
+      self.decoder.reset()
+      self._show_status("Connected to %s:%d." % (self.server["HOST"], self.server["PORT"]))
+      self.set_connect_button_sensitive(False, connected=True)
 
-      self.check_io_event = GObject.timeout_add(1000, self._on_telnet_io)
+      # Let the main loop tell us as soon as there is data to read (or the connection has been closed), rather than polling the socket.
+      self.check_io_event = GObject.io_add_watch(self.connection.get_socket(), GObject.IO_IN | GObject.IO_PRI | GObject.IO_ERR | GObject.IO_HUP, self._on_telnet_io)
+      # Show anything that has already been received during the login.
+      self._on_telnet_io()
+      return False
 
+   def _on_connection_failed(self, message, attempt):
+      """ Report a failed attempt to connect, and try again later (waiting twice as long each time). """
+      if(attempt != self.attempt):
+         return False
+      self._schedule_reconnect("Could not connect to %s:%d (%s)." % (self.server["HOST"], self.server["PORT"], message))
+      return False
+
+   def _schedule_reconnect(self, message):
+      """ Show a message explaining why the connection has been lost (or could not be made), and set up a timer to reconnect. """
+      self._show_status("%s Reconnecting in %d seconds..." % (message, self.reconnect_delay))
+      self.reconnect_event = GObject.timeout_add_seconds(self.reconnect_delay, self._on_reconnect_timeout)
+      self.reconnect_delay = min(2*self.reconnect_delay, RECONNECT_DELAY_MAX)
       return
 
+   def _on_reconnect_timeout(self):
+      self._start_connecting()
+      return False
+
    def telnet_disconnect(self, widget=None):
-      """ Disconnect from a Telnet server and remove the I/O timer. """
+      """ Disconnect from a Telnet server (or stop trying to connect to one), and remove the I/O watch. """
+      self._close_connection()
+      self.attempt = self.attempt + 1 # Ignore the result of any connection attempt that is in progress.
+      if(self.reconnect_event is not None):
+         GObject.source_remove(self.reconnect_event)
+         self.reconnect_event = None
+      self.server = None
+      self.buffer.set_text("")
+      self.spot_store.clear()
+      self.spots.clear()
+      self.set_connect_button_sensitive(True)
+      return
+
+   def _close_connection(self):
+      """ Close the connection to the Telnet server (if there is one) and remove the I/O watch. """
       if(self.connection):
          self.connection.close()
-      self.buffer.set_text("")
       self.connection = None
-      self.set_connect_button_sensitive(True)
-      GObject.source_remove(self.check_io_event)
+      if(self.check_io_event is not None):
+         GObject.source_remove(self.check_io_event)
+         self.check_io_event = None
       return
 
    def telnet_send_command(self, widget=None):
@@ -150,31 +309,130 @@ class DXCluster(Gtk.VBox):
          self.command.set_text("")
       return
 
-   def _on_telnet_io(self):
-      """ Retrieve any new data from the Telnet server and print it out in the Gtk.TextView widget. Always returns True to satisfy the GObject timer. """
+   def _on_telnet_io(self, source=None, condition=None):
+      """ Retrieve any new data from the Telnet server and print it out in the Gtk.TextView widget. This is called by the GObject I/O watch whenever
+      the connection's socket becomes readable. Returns True to keep the watch, or False if the connection has been closed. """
       if(self.connection):
-         text = self.connection.read_very_eager()
-         text = text.replace(u"\u0007", "") # Remove the BEL Unicode character from the end of the line
+         try:
+            # This only reads the data that has already arrived, so it never blocks.
+            text = self.connection.read_very_eager()
+         except (EOFError, socket.error) as e:
+            logging.error("The connection to the Telnet server has been closed.")
+            self.check_io_event = None # The watch is removed when this method returns False.
+            self._close_connection()
+            self.set_connect_button_sensitive(False)
+            self._schedule_reconnect("The connection to %s:%d has been lost." % (self.server["HOST"], self.server["PORT"]))
+            return False
+         if(text == ""):
+            # Only Telnet option negotiation (or nothing at all) was received.
+            return True
+         # Decode the data explicitly. Any bytes which are not valid UTF-8 (e.g. in a spot's comment) are replaced, rather than raising a UnicodeDecodeError.
+         text = self.decoder.decode(text).replace(u"\u0007", u"") # Remove the BEL Unicode character from the end of the line
+         self._append_text(text)
 
-         # Allow auto-scrolling to the new text entry if the focus is already at
-         # the very end of the Gtk.TextView. Otherwise, don't auto-scroll
-         # in case the user is reading something further up.
-         # Note: This is based on the code from http://forums.gentoo.org/viewtopic-t-445598-view-next.html
-         end_iter = self.buffer.get_end_iter()
-         end_mark = self.buffer.create_mark(None, end_iter)
-         self.renderer.move_mark_onscreen(end_mark)
-         at_end = self.buffer.get_iter_at_mark(end_mark).equal(end_iter)
-         self.buffer.insert(end_iter, text)
-         if(at_end):
-            end_mark = self.buffer.create_mark(None, end_iter)
-            self.renderer.scroll_mark_onscreen(end_mark) 
+         # Look for spots in each complete line. The last line is kept until the rest of it arrives.
+         lines = (self.partial_line + text).split("\n")
+         self.partial_line = lines.pop()
+         for line in lines:
+            spot = parse_spot(line)
+            if(spot is not None):
+               self.add_spot(spot)
 
       return True
 
-   def set_connect_button_sensitive(self, sensitive):
-      """ Enable/disable the relevant buttons for connecting/disconnecting from a DX cluster, so that users cannot click the connect button if PyQSO is already connected. """
+   def add_spot(self, spot):
+      """ Add a spot (as returned by parse_spot) to the spot table. If the table is full, the oldest spot is removed. """
+      if(len(self.spots) >= MAX_SPOTS):
+         (old_spot, old_iter) = self.spots.popleft()
+         self.spot_store.remove(old_iter)
+      iter = self.spot_store.append([spot["TIME"], spot["FREQ"], "%.4f" % spot["FREQ"], spot["BAND"], spot["CALL"], spot["COMMENT"], spot["SPOTTER"], self._get_spot_status(spot)])
+      self.spots.append((spot, iter))
+      return
+
+   def update_spot_status(self, widget=None):
+      """ Work out again whether each spot in the spot table has been worked before, e.g. after a record has been added to the logbook. """
+      for (spot, iter) in self.spots:
+         self.spot_store.set_value(iter, 7, self._get_spot_status(spot))
+      return
+
+   def _get_spot_status(self, spot):
+      """ Return whether a spotted station has been worked before, or is needed for the awards table, using the Awards tool's index of worked stations. """
+      if(spot["BAND"] == ""):
+         return ""
+      return self.parent.toolbox.awards.get_spot_status(spot["CALL"], spot["BAND"], spot["MODE"])
+
+   def _show_status(self, message):
+      """ Show a message about the state of the connection in the Gtk.TextView widget, on a line of its own. """
+      logging.debug(message)
+      end_iter = self.buffer.get_end_iter()
+      if(not end_iter.starts_line()):
+         message = "\n" + message
+      self._append_text(message + "\n")
+      return
+
+   def _append_text(self, text):
+      """ Add some text to the end of the Gtk.TextView widget. """
+      # Allow auto-scrolling to the new text entry if the focus is already at
+      # the very end of the Gtk.TextView. Otherwise, don't auto-scroll
+      # in case the user is reading something further up.
+      # Note: This is based on the code from http://forums.gentoo.org/viewtopic-t-445598-view-next.html
+      end_iter = self.buffer.get_end_iter()
+      end_mark = self.buffer.create_mark(None, end_iter)
+      self.renderer.move_mark_onscreen(end_mark)
+      at_end = self.buffer.get_iter_at_mark(end_mark).equal(end_iter)
+      self.buffer.delete_mark(end_mark)
+      self.buffer.insert(end_iter, text)
+      # Don't let the output grow without limit during a long session.
+      excess_lines = self.buffer.get_line_count() - MAX_OUTPUT_LINES
+      if(excess_lines > 0):
+         self.buffer.delete(self.buffer.get_start_iter(), self.buffer.get_iter_at_line(excess_lines))
+      if(at_end):
+         end_iter = self.buffer.get_end_iter()
+         end_mark = self.buffer.create_mark(None, end_iter)
+         self.renderer.scroll_mark_onscreen(end_mark) 
+         self.buffer.delete_mark(end_mark)
+      return
+
+   def set_connect_button_sensitive(self, sensitive, connected=False):
+      """ Enable/disable the relevant buttons for connecting/disconnecting from a DX cluster, so that users cannot click the connect button if PyQSO is already connected
+      (or is trying to connect). Commands can only be sent once the connection has been made, so the caller should set 'connected' to True once it has. """
       self.buttons["CONNECT"].set_sensitive(sensitive)
       self.buttons["DISCONNECT"].set_sensitive(not sensitive)
-      self.send.set_sensitive(not sensitive)
+      self.send.set_sensitive(connected)
       return
 
+class TestDXCluster(unittest.TestCase):
+
+   def test_parse_spot(self):
+      spot = parse_spot("DX de G4ABC:     14025.0  ja1xyz       CQ CQ up 2                     1234Z")
+      assert(spot == {"SPOTTER":"G4ABC", "FREQ":14.025, "BAND":"20m", "CALL":"JA1XYZ", "COMMENT":"CQ CQ up 2", "TIME":"1234", "MODE":None})
+      # The mode is picked out of the comment, if there is one.
+      assert(parse_spot("DX de G4ABC:     14080.0  JA1XYZ       rtty 599                       1234Z")["MODE"] == "RTTY")
+      # Some clusters add a locator after the time. The comment may also be empty.
+      spot = parse_spot("DX de W3LPL-#:    7025.1  ZS6AAA                                    2102Z FN20")
+      assert(spot["SPOTTER"] == "W3LPL-#" and spot["CALL"] == "ZS6AAA" and spot["COMMENT"] == "" and spot["TIME"] == "2102" and spot["BAND"] == "40m")
+      # Frequencies outside the bands are still spots.
+      assert(parse_spot("DX de M0ABC:  11000.0  TEST  test 0000Z")["BAND"] == "")
+      # Other output from the cluster should be ignored.
+      assert(parse_spot("Hello G4ABC, this is DXSpider") is None)
+      assert(parse_spot("WWV de VE7CC <18>:   SFI=70, A=5, K=1, No Storms -> No Storms") is None)
+
+   def test_on_telnet_io(self):
+      class TestConnection:
+         # A UTF-8 character (split across two reads) and a byte which is not valid UTF-8 in a spot's comment, followed by the BEL character.
+         reads = ["DX de M0ABC:  11000.0  TEST  Caf\xc3", "\xa9 \xff 0000Z\x07\n"]
+         def read_very_eager(self):
+            return self.reads.pop(0)
+      dx_cluster = DXCluster(parent=None)
+      dx_cluster.connection = TestConnection()
+      received = []
+      dx_cluster._append_text = received.append
+      assert(dx_cluster._on_telnet_io())
+      assert(dx_cluster._on_telnet_io())
+      print "Received text: ", received
+      assert(u"".join(received) == u"DX de M0ABC:  11000.0  TEST  Caf\xe9 \ufffd 0000Z\n")
+      assert(len(dx_cluster.spots) == 1)
+      assert(dx_cluster.spots[0][0]["COMMENT"] == u"Caf\xe9 \ufffd")
+
+if(__name__ == '__main__'):
+   unittest.main()
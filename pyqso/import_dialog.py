@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# File: import_dialog.py
+
+#    Copyright (C) 2013 Christian Jacobs.
+
+#    This file is part of PyQSO.
+
+#    PyQSO is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    PyQSO is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with PyQSO.  If not, see <http://www.gnu.org/licenses/>.
+
+from gi.repository import Gtk, GObject
+import logging
+import time
+import os
+
+class ImportProgressDialog(Gtk.Dialog):
+   """ A dialog which shows the progress of an ADIF file import: the fraction of the file that has been read, the import rate (in records per second),
+   and an estimate of the time remaining. The import runs in the background (see ImportWorker), so the dialog is not modal.
+   The import can be stopped with the Stop button, and resumed later. """
+
+   def __init__(self, parent, path, start=0, records=0, on_stop=None):
+      logging.debug("Setting up the import progress dialog...")
+
+      Gtk.Dialog.__init__(self, title="Importing Log", parent=parent, flags=Gtk.DialogFlags.DESTROY_WITH_PARENT, buttons=(Gtk.STOCK_STOP, Gtk.ResponseType.CANCEL))
+
+      self.size = os.path.getsize(path)
+      # The rates are measured from the position (and number of records) that the import started or resumed from.
+      self.start = start
+      self.start_records = records
+      self.start_time = time.time()
+      self.on_stop = on_stop
+      self.stopping = False
+      self.connect("response", self._on_response)
+      # Keep the dialog open until the import has actually stopped.
+      self.connect("delete-event", lambda widget, event: True)
+
+      label = Gtk.Label("Importing records from %s..." % os.path.basename(path))
+      label.set_alignment(0, 0.5)
+      self.vbox.pack_start(label, False, False, 6)
+      self.progress_bar = Gtk.ProgressBar()
+      self.progress_bar.set_show_text(True)
+      self.vbox.pack_start(self.progress_bar, False, False, 6)
+      self.status_label = Gtk.Label()
+      self.status_label.set_alignment(0, 0.5)
+      self.vbox.pack_start(self.status_label, False, False, 6)
+
+      self.set_default_size(400, -1)
+      self.show_all()
+      return
+
+   def update(self, records, position):
+      """ Show that 'records' records have been imported so far, and that the import has reached 'position' bytes into the file. """
+      elapsed = time.time() - self.start_time
+
+      if(self.size > 0):
+         self.progress_bar.set_fraction(min(float(position)/self.size, 1.0))
+      self.progress_bar.set_text("%d record(s) imported" % records)
+      if(elapsed > 0 and position > self.start and not self.stopping):
+         rate = (position - self.start)/elapsed # In bytes per second.
+         remaining = int((self.size - position)/rate)
+         self.status_label.set_text("%.0f records/s. About %d:%02d remaining." % ((records - self.start_records)/elapsed, remaining/60, remaining % 60))
+      return
+
+   def _on_response(self, widget, response):
+      if(response == Gtk.ResponseType.CANCEL or response == Gtk.ResponseType.DELETE_EVENT):
+         logging.debug("The user asked for the import to stop.")
+         self.stopping = True
+         self.status_label.set_text("Stopping...")
+         self.set_response_sensitive(Gtk.ResponseType.CANCEL, False)
+         if(self.on_stop is not None):
+            self.on_stop()
+      return
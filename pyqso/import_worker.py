@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# File: import_worker.py
+
+#    Copyright (C) 2013 Christian Jacobs.
+
+#    This file is part of PyQSO.
+
+#    PyQSO is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    PyQSO is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with PyQSO.  If not, see <http://www.gnu.org/licenses/>.
+
+from gi.repository import GObject
+import logging
+import threading
+import sqlite3 as sqlite
+
+from adif import ADIF
+from log import run_import
+
+class ImportWorker(threading.Thread):
+   """ Imports the records from an ADIF file into a log in a background thread, so that the user interface stays responsive during a long import.
+   The thread has its own connection to the logbook's database. Progress and completion are reported back to the GTK main loop via GObject.idle_add. """
+
+   def __init__(self, database_path, log, path, file_hash, start=0, records=0, on_progress=None, on_finished=None):
+      """ Set up an import of the ADIF file with a given path (and hash) into a given Log, starting from position 'start' in the file.
+      'records' is the number of records that have already been imported from the file (if the import is being resumed).
+      'on_progress' is called in the main thread after each batch of records is committed, with the same arguments as the 'progress' argument of log.run_import.
+      'on_finished' is called in the main thread once the import has finished (or stopped), with the number of records added and True if the import is complete. """
+      threading.Thread.__init__(self, name="ImportWorker")
+      self.daemon = True
+
+      self.database_path = database_path
+      self.log_name = log.name
+      # The Log's database connection can only be used in the main thread, so the insert query is resolved here rather than in the worker thread.
+      (self.query, self.field_names) = log._get_insert_query()
+      self.path = path
+      self.file_hash = file_hash
+      self.start_position = start
+      self.records = records
+      self.on_progress = on_progress
+      self.on_finished = on_finished
+      self.stopped = False
+      return
+
+   def stop(self):
+      """ Ask the import to stop once the current batch of records has been committed. The import can be resumed later from its checkpoint. """
+      self.stopped = True
+      return
+
+   def run(self):
+      added = 0
+      complete = False
+      if(self.query is None):
+         logging.error("Could not import the records into log %s." % self.log_name)
+      else:
+         try:
+            connection = sqlite.connect(self.database_path)
+            # Note: The records are parsed serially here. ADIF.iter_records_parallel would fork this (multi-threaded) process along with its open database connections.
+            records = ADIF().iter_records(self.path, start=self.start_position, positions=True)
+            try:
+               (added, complete) = run_import(connection, self.log_name, self.query, self.field_names, records, self.path, self.file_hash,
+                                              total=self.records, progress=self._on_progress)
+            finally:
+               records.close() # Close the ADIF file (if the import was stopped early).
+               connection.close()
+         except sqlite.Error as e:
+            logging.exception(e)
+      if(self.on_finished is not None):
+         GObject.idle_add(self.on_finished, added, complete)
+      return
+
+   def _on_progress(self, total, position, after_index, last_index):
+      if(self.on_progress is not None):
+         GObject.idle_add(self.on_progress, total, position, after_index, last_index)
+      return not self.stopped
@@ -20,125 +20,931 @@
 
 from gi.repository import Gtk, GObject
 from os.path import basename
+import os
+import hashlib
 import logging
 import sqlite3 as sqlite
 import unittest
+import re
+import calendar
+from datetime import datetime, timedelta
+from itertools import islice
+from array import array
+from collections import OrderedDict
 
 from adif import AVAILABLE_FIELD_NAMES_TYPES, AVAILABLE_FIELD_NAMES_ORDERED
 from record_dialog import *
 
-class Log(Gtk.ListStore):
-   """ A Log object can store multiple Record objects. """
+# The number of records inserted per transaction when adding records in bulk with Log.add_records.
+BATCH_SIZE = 1000
+# The indexes that are maintained on every log's database table, as (name suffix, indexed columns) pairs. The first index speeds up duplicate detection,
+# and the second speeds up callsign look-ups. The callsign index is case-insensitive so that it can also be used by case-insensitive LIKE queries.
+# The rest speed up sorting the log by the most commonly sorted fields (see Log.get_sort_expressions).
+# The index on the timestamp column speeds up date/time range queries (see Log.add_missing_timestamp_column).
+DB_INDEXES = [("duplicate_key", ["call", "qso_date", "time_on", "freq", "mode"]),
+              ("call", ["call COLLATE NOCASE"]),
+              ("qso_date", ["qso_date", "time_on"]),
+              ("freq", ["CAST(freq AS REAL)"]),
+              ("qso_timestamp", ["qso_timestamp"])]
+# The type of the database column for each numeric field, in logs with typed columns. All the other fields are stored in TEXT columns.
+TYPED_DB_COLUMN_TYPES = {"FREQ": "REAL", "TX_PWR": "REAL", "DXCC": "INTEGER", "CQZ": "INTEGER", "ITUZ": "INTEGER"}
+# The name of the database column which holds the UTC date and time of each QSO (in seconds since the Unix epoch), derived from the QSO_DATE and TIME_ON fields.
+TIMESTAMP_COLUMN = "qso_timestamp"
+# The number of record indices retrieved from the database at a time when populating a Log incrementally.
+POPULATE_CHUNK_SIZE = 5000
+# The number of records copied at a time when converting a log to typed columns (see Log.convert_to_typed_columns_incrementally).
+CONVERSION_CHUNK_SIZE = 10000
+# The number of records fetched from the database at a time when going through the results of Log.query.
+QUERY_PAGE_SIZE = 1000
+# The number of records fetched from the database at a time when the TreeView asks for a record that is not already in memory.
+PAGE_SIZE = 100
+# The maximum number of pages of records that each Log keeps in memory. The least recently used page is discarded first.
+MAX_CACHED_PAGES = 50
+# The names of the database tables that PyQSO uses internally (rather than for storing a log) all start with this prefix.
+INTERNAL_TABLE_PREFIX = "pyqso_"
+# The fields that are included in each log's full-text search index.
+FTS_FIELD_NAMES = ["NOTES", "NAME", "ADDRESS", "COUNTRY"]
+# The maximum number of records returned by a single full-text search of a log.
+SEARCH_PAGE_SIZE = 50
+# The name of the database table which records how far each unfinished import of an ADIF file has got (see Log.import_records).
+CHECKPOINT_TABLE = INTERNAL_TABLE_PREFIX + "import_checkpoint"
+
+def get_db_column_type(field_name, typed=False):
+   """ Return the type of the database column for the field called 'field_name'. This is always TEXT unless 'typed' is True. """
+   if(typed):
+      return TYPED_DB_COLUMN_TYPES.get(field_name, "TEXT")
+   else:
+      return "TEXT"
+
+def get_create_table_query(log_name, typed=False):
+   """ Return the SQL query that creates the database table for a new log called 'log_name'.
+   If 'typed' is True, then the numeric fields are stored in REAL or INTEGER columns (see TYPED_DB_COLUMN_TYPES), so that SQLite stores them as numbers. """
+   query = "CREATE TABLE %s (id INTEGER PRIMARY KEY AUTOINCREMENT" % log_name
+   for field_name in AVAILABLE_FIELD_NAMES_ORDERED:
+      query = query + ", %s %s" % (field_name.lower(), get_db_column_type(field_name, typed))
+   return query + ")"
+
+def get_timestamp_expression(qso_date="qso_date", time_on="time_on"):
+   """ Return an SQL expression which converts the QSO_DATE (YYYYMMDD) and TIME_ON (HHMM or HHMMSS) fields into the number of seconds since the Unix epoch,
+   or NULL if the date is not valid. The fields are given by the SQL expressions 'qso_date' and 'time_on' (e.g. "new.qso_date" in a trigger, or a query parameter).
+   A missing time is treated as midnight. """
+   time_on = "IFNULL(%s, '') || '000000'" % time_on
+   return "CAST(strftime('%%s', substr(%s, 1, 4) || '-' || substr(%s, 5, 2) || '-' || substr(%s, 7, 2) || ' ' || substr(%s, 1, 2) || ':' || substr(%s, 3, 2) || ':' || substr(%s, 5, 2)) AS INTEGER)" % (qso_date, qso_date, qso_date, time_on, time_on, time_on)
+
+def get_fts_table_name(log_name):
+   """ Return the name of the database table that holds the full-text search index of the log called 'log_name'. """
+   return "%sfts_%s" % (INTERNAL_TABLE_PREFIX, log_name)
+
+def get_fts_query(text):
+   """ Turn some text entered by the user into a full-text search query which matches the records containing all the words in the text
+   (or words starting with them). Return None if the text does not contain any words.
+   Any punctuation (e.g. quotes) in the text is ignored, so the query is always valid. """
+   if(isinstance(text, str)):
+      text = text.decode("utf-8", "replace")
+   # Note: The search terms are converted to lower case so that they are not mistaken for the AND, OR and NOT operators.
+   terms = re.findall(r"\w+", text.lower(), re.UNICODE)
+   if(len(terms) == 0):
+      return None
+   return " ".join([term + "*" for term in terms])
+
+def create_checkpoint_table(c):
+   """ Create the database table that holds the import checkpoints (see Log.import_records), using the cursor 'c', if it does not exist already. """
+   c.execute("CREATE TABLE IF NOT EXISTS %s (log_name TEXT, path TEXT, file_hash TEXT, position INTEGER, records INTEGER, PRIMARY KEY (log_name, path))" % CHECKPOINT_TABLE)
+   return
+
+def get_file_hash(path):
+   """ Return a hash of the size and modification time of the file with a given path. This changes whenever the file is modified,
+   in which case an import checkpoint for the file can no longer be trusted. """
+   status = os.stat(path)
+   return hashlib.sha1("%d:%r" % (status.st_size, status.st_mtime)).hexdigest()
+
+def run_import(connection, log_name, insert_query, field_names, records, path, file_hash, total=0, batch_size=BATCH_SIZE, progress=None):
+   """ Add the records being read from the ADIF file with a given path (and hash, from get_file_hash) to the log called 'log_name', in transactions of
+   'batch_size' records at a time. The records are inserted with the Log's insert query and field names (from Log._get_insert_query).
+   Only the given database 'connection' is used, so this can run in a different thread to the Log itself, provided that the thread has its own connection.
+   The 'records' should be an iterable of (record, position) tuples, where 'position' is the position in the file just after the record
+   (e.g. as produced by ADIF.iter_records with positions=True). 'total' is the number of records that were imported before the first of these records.
+
+   The position of the last record in each batch is saved in a checkpoint, in the same transaction as the batch itself. If the import is interrupted,
+   it can therefore be resumed from the position given by Log.get_import_checkpoint without adding any records twice. The checkpoint is removed once the import is complete.
+   If 'progress' is given, then it is called after each batch is committed with the total number of records imported so far, the current position in the file,
+   and the range of indices given to the batch's records (i.e. they are greater than the third argument and no greater than the fourth).
+   The import stops early (but can still be resumed) if it returns False.
+
+   Return a tuple containing the number of records that were added, and True if the import is complete (False otherwise). """
+   logging.debug("Importing records from %s into log %s..." % (path, log_name))
+   added = 0
+   complete = False
+   records = iter(records)
+   try:
+      while True:
+         batch = []
+         position = None
+         for (fields_and_data, position) in islice(records, batch_size):
+            batch.append([fields_and_data.get(field_name, "") for field_name in field_names])
+         if(len(batch) == 0):
+            with connection:
+               c = connection.cursor()
+               create_checkpoint_table(c)
+               c.execute("DELETE FROM %s WHERE log_name=? AND path=?" % CHECKPOINT_TABLE, [log_name, path])
+            complete = True
+            break
+         with connection:
+            c = connection.cursor()
+            create_checkpoint_table(c)
+            c.executemany(insert_query, batch)
+            # The records in the batch are given consecutive indices, since they are all inserted in the same transaction.
+            c.execute("SELECT MAX(id) FROM %s" % log_name)
+            last_index = c.fetchone()[0]
+            after_index = last_index - len(batch)
+            c.execute("INSERT OR REPLACE INTO %s VALUES (?,?,?,?,?)" % CHECKPOINT_TABLE, [log_name, path, file_hash, position, total + len(batch)])
+         added += len(batch)
+         total += len(batch)
+         if(progress is not None and progress(total, position, after_index, last_index) is False):
+            logging.debug("The import was stopped after %d record(s)." % total)
+            break
+   except sqlite.Error as e:
+      # Everything up to the last committed batch (and its checkpoint) is kept, so the import can be resumed from there.
+      logging.exception(e)
+      logging.error("Could not import a batch of records into the log.")
+
+   logging.debug("Successfully imported %d record(s) into the log." % added)
+   return (added, complete)
+
+class Log(GObject.GObject, Gtk.TreeModel):
+   """ A Log object can store multiple Record objects. The records themselves are kept in the SQL database; the Log implements the Gtk.TreeModel interface
+   and fetches the records from the database in pages (as and when they are displayed), so only the records that are visible in the TreeView are held in memory. """
    
    def __init__(self, connection, name):
 
-      # The ListStore constructor needs to know the data types of the columns.
-      # The index is always an integer. We will assume the fields are strings.
-      data_types = [int] + [str]*len(AVAILABLE_FIELD_NAMES_ORDERED)    
-      # Call the constructor of the super class (Gtk.ListStore)
-      Gtk.ListStore.__init__(self, *data_types)
+      # Call the constructor of the super class (GObject.GObject)
+      GObject.GObject.__init__(self)
 
       self.connection = connection
       self.name = name
+
+      # The index of each record in the log (i.e. its value in the 'id' database column), in the order that the records are displayed.
+      # This is the only per-record data that is always kept in memory.
+      self.rowids = array("l")
+      # Becomes True once the index of every record in the database table has been retrieved.
+      self.populated = False
+      # If this is not empty, then the Log is only populated with the records whose callsign starts with it (ignoring case).
+      self.callsign_filter = ""
+      # The field that the records are sorted by (or None to sort them by their index), and whether they are sorted in descending order.
+      self.sort_field_name = None
+      self.sort_descending = False
+      # The index of each record that is still to be added to the Log while it is being populated.
+      self.pending_rowids = array("l")
+      # The most recently used pages of records, keyed by page number.
+      self.pages = OrderedDict()
+
+      # The database column names and the SQL queries built from them are cached here,
+      # so that the table's schema does not need to be queried for every record that is added or edited.
+      self.invalidate_schema_cache()
       
       logging.debug("New Log instance created!")
       return
 
    def populate(self):
-      """ Remove everything in the Gtk.ListStore that is rendered already (via the TreeView), and start afresh. """
+      """ Remove everything in the Log that is rendered already (via the TreeView), and start afresh. Only the index of each record is retrieved here;
+      the rest of each record's data is fetched on demand when the record is displayed. """
+      for number_of_records in self.populate_incrementally():
+         pass
+      return
+
+   def populate_incrementally(self, chunk_size=POPULATE_CHUNK_SIZE):
+      """ The same as the populate method, except that this is a generator which adds 'chunk_size' records at a time to the Log,
+      and yields the number of records in the Log after each chunk. This allows a large log to be populated bit-by-bit (e.g. from an idle handler)
+      without blocking the user interface. """
 
       logging.debug("Populating '%s'..." % self.name)
+      self.populated = False
       self.add_missing_db_columns()
-      self.clear()
-      records = self.get_all_records()
-      if(records is not None):
-         for r in records:
-            liststore_entry = [r["id"]]
-            for field_name in AVAILABLE_FIELD_NAMES_ORDERED:
-               # Note: r may contain column names that are not in AVAILABLE_FIELD_NAMES_ORDERED, 
-               # so we need to loop over and only select those that are, since the ListStore will
-               # expect a specific number of columns.
-               liststore_entry.append(r[field_name])
-            self.append(liststore_entry)
-         logging.debug("Finished populating '%s'." % self.name)
-      else:
+      self.add_missing_timestamp_column()
+      self.add_missing_db_indexes()
+      self.add_missing_fts_index()
+
+      # Remove all the existing rows. Start from the end so that the paths of the remaining rows do not change.
+      while(len(self.rowids) > 0):
+         self.rowids.pop()
+         self.row_deleted(Gtk.TreePath(len(self.rowids)))
+      self.pages.clear()
+
+      # Retrieving the index of every record, in order, is quick since the database does the filtering and sorting (using the indexes on the table)...
+      self.pending_rowids = self._get_sorted_rowids()
+      if(self.pending_rowids is None):
          logging.error("Could not populate '%s' because of a database error." % self.name)
+         self.pending_rowids = array("l")
+         return
+
+      # ...but telling the TreeView about each new row is not, so this is done a chunk at a time.
+      # Note: Records that are added to (or deleted from) the log in the meantime are added to (or removed from) pending_rowids.
+      while(len(self.pending_rowids) > 0):
+         chunk = self.pending_rowids[:chunk_size]
+         del self.pending_rowids[:chunk_size]
+         for rowid in chunk:
+            self.rowids.append(rowid)
+            path = Gtk.TreePath(len(self.rowids)-1)
+            self.row_inserted(path, self.get_iter(path))
+         yield len(self.rowids)
+
+      self.populated = True
+      logging.debug("Finished populating '%s'." % self.name)
+      return
+
+   def _get_sorted_rowids(self):
+      """ Return an array containing the index of every record that matches the callsign filter, in the order given by the sort_field_name and sort_descending attributes.
+      Return None if there is a database error. """
+      (conditions, parameters) = self._get_callsign_filter_conditions()
+      query = "SELECT id FROM %s" % self.name
+      if(len(conditions) > 0):
+         query = query + " WHERE " + " AND ".join(conditions)
+      direction = " DESC" if self.sort_descending else ""
+      query = query + " ORDER BY " + ", ".join([expression + direction for expression in self.get_sort_expressions(self.sort_field_name)])
+      try:
+         with self.connection:
+            c = self.connection.cursor()
+            c.execute(query, parameters)
+            return array("l", [row[0] for row in c])
+      except sqlite.Error as e:
+         logging.exception(e)
+         return None
+
+   def get_sort_expressions(self, field_name):
+      """ Return a list of the SQL expressions that the records are ordered by when the log is sorted by the field called 'field_name' (or by the records' indices, if this is None).
+      The record's index always comes last, to break any ties. """
+      if(field_name is None):
+         return ["id"]
+      field_type = AVAILABLE_FIELD_NAMES_TYPES[field_name]
+      if(field_type == "N"):
+         # Numbers are stored as text, so they must be converted to numbers to sort them numerically (e.g. so that 7.1 comes before 14.2).
+         return ["CAST(%s AS REAL)" % field_name.lower(), "id"]
+      elif(field_name == "QSO_DATE"):
+         # Records on the same date are sorted by time, so that they are in chronological order.
+         # Note: ADIF dates (YYYYMMDD) and times (HHMM or HHMMSS) already sort correctly as text.
+         return ["qso_date", "time_on", "id"]
+      elif(field_name == "CALL"):
+         return ["call COLLATE NOCASE", "id"]
+      else:
+         return [field_name.lower(), "id"]
+
+   def sort(self, field_name, descending=False):
+      """ Sort the records in the Log by the field called 'field_name' (or by their indices, if this is None), in descending order if 'descending' is True.
+      The database does the sorting. If the Log has been populated, then the rows are re-ordered in one go, and True is returned.
+      Otherwise, False is returned, and the Log will need to be re-populated to put the rows in the new order. """
+      self.sort_field_name = field_name
+      self.sort_descending = descending
+      if(not self.populated):
+         return False
+
+      rowids = self._get_sorted_rowids()
+      if(rowids is None):
+         return False
+      # Work out where each row has moved to.
+      old_positions = dict(zip(self.rowids, xrange(len(self.rowids))))
+      try:
+         new_order = [old_positions[rowid] for rowid in rowids]
+      except KeyError:
+         new_order = None
+      if(new_order is None or len(new_order) != len(self.rowids)):
+         # The records in the database no longer match the rows in the Log (e.g. because the database has been modified by something else).
+         return False
+      self.rowids = rowids
+      self.pages.clear()
+      if(len(new_order) > 0):
+         self.rows_reordered(Gtk.TreePath(), None, new_order)
+      return True
+
+   def _get_callsign_filter_conditions(self):
+      """ Return a tuple containing a list of SQL conditions (to be joined with AND) that select the records matching the callsign filter, and a list of the conditions' parameters. """
+      if(self.callsign_filter == ""):
+         return ([], [])
+      # A prefix match is the same as a range query, e.g. all the callsigns starting with "m0a" are >= "m0a" and < "m0b" (ignoring case).
+      # Unlike LIKE, this can always be answered with a search of the case-insensitive index on the CALL column.
+      lower_bound = self.callsign_filter.lower()
+      if(isinstance(lower_bound, str)):
+         lower_bound = lower_bound.decode("utf-8", "replace")
+      upper_bound = lower_bound[:-1] + unichr(ord(lower_bound[-1]) + 1)
+      return (["call >= ? COLLATE NOCASE", "call < ? COLLATE NOCASE"], [lower_bound, upper_bound])
+
+   def _matches_callsign_filter(self, fields_and_data):
+      """ Return True if a record (given as a dictionary of field-value pairs) matches the callsign filter, and False otherwise. """
+      callsign = fields_and_data.get("CALL")
+      if(callsign is None):
+         callsign = ""
+      return callsign.lower().startswith(self.callsign_filter.lower())
+
+   def _get_page(self, page_number):
+      """ Return the page of records with a given page number, as a list of tuples (one tuple of field data per record, in the order of AVAILABLE_FIELD_NAMES_ORDERED).
+      The page is fetched from the database if it is not already in memory. """
+      if(page_number in self.pages):
+         # Mark this page as the most recently used one.
+         page = self.pages.pop(page_number)
+         self.pages[page_number] = page
+         return page
+
+      rowids = self.rowids[page_number*PAGE_SIZE:(page_number+1)*PAGE_SIZE].tolist()
+      records = {}
+      try:
+         with self.connection:
+            c = self.connection.cursor()
+            c.execute("SELECT %s FROM %s WHERE id IN (%s)" % (self._get_select_columns(), self.name, ", ".join(["?"]*len(rowids))), rowids)
+            for r in c:
+               records[r["id"]] = tuple([r[field_name] for field_name in AVAILABLE_FIELD_NAMES_ORDERED])
+      except sqlite.Error as e:
+         logging.exception(e)
+         logging.error("Could not retrieve records from '%s' because of a database error." % self.name)
+      # A record might have been removed from the database by something other than this Log, in which case its fields are left blank.
+      empty = tuple([""]*len(AVAILABLE_FIELD_NAMES_ORDERED))
+      page = [records.get(rowid, empty) for rowid in rowids]
+
+      self.pages[page_number] = page
+      if(len(self.pages) > MAX_CACHED_PAGES):
+         self.pages.popitem(last=False) # Discard the least recently used page.
+      return page
+
+   def _discard_pages(self, position, following=False):
+      """ Remove the page of records containing the row at a given position from memory, so that it is fetched again from the database when it is next needed.
+      If 'following' is True, then all the pages after it are removed too (e.g. because the rows after the given position have moved). """
+      page_number = position // PAGE_SIZE
+      if(following):
+         for n in [n for n in self.pages.keys() if n >= page_number]:
+            del self.pages[n]
+      else:
+         self.pages.pop(page_number, None)
       return
 
+   def _create_iter(self, position):
+      """ Return a tuple containing True and a Gtk.TreeIter pointing at the row with a given position, or (False, None) if there is no such row. """
+      if(position < 0 or position >= len(self.rowids)):
+         return (False, None)
+      iter = Gtk.TreeIter()
+      iter.user_data = position + 1 # Note: A user_data value of zero would be treated as a NULL pointer, so offset the position by one.
+      return (True, iter)
+
+   def _get_position(self, iter):
+      """ Return the position of the row that a given Gtk.TreeIter points at. """
+      return iter.user_data - 1
+
+   # Implementation of the Gtk.TreeModel interface. The log is a flat list, so no row has any children.
+
+   def do_get_flags(self):
+      return Gtk.TreeModelFlags.LIST_ONLY
+
+   def do_get_n_columns(self):
+      # The index is always an integer. The fields are all strings.
+      return 1 + len(AVAILABLE_FIELD_NAMES_ORDERED)
+
+   def do_get_column_type(self, column):
+      if(column == 0):
+         return GObject.TYPE_INT
+      else:
+         return GObject.TYPE_STRING
+
+   def do_get_iter(self, path):
+      return self._create_iter(path.get_indices()[0])
+
+   def do_get_path(self, iter):
+      return Gtk.TreePath(self._get_position(iter))
+
+   def do_get_value(self, iter, column):
+      position = self._get_position(iter)
+      if(column == 0):
+         # No need to go to the database for the index.
+         return self.rowids[position]
+      else:
+         return self._get_page(position // PAGE_SIZE)[position % PAGE_SIZE][column-1]
+
+   def do_iter_next(self, iter):
+      position = self._get_position(iter) + 1
+      if(position >= len(self.rowids)):
+         return False
+      iter.user_data = position + 1
+      return True
+
+   def do_iter_previous(self, iter):
+      position = self._get_position(iter) - 1
+      if(position < 0):
+         return False
+      iter.user_data = position + 1
+      return True
+
+   def do_iter_children(self, parent):
+      if(parent is None):
+         return self._create_iter(0)
+      return (False, None)
+
+   def do_iter_has_child(self, iter):
+      return False
+
+   def do_iter_n_children(self, iter):
+      if(iter is None):
+         return len(self.rowids)
+      return 0
+
+   def do_iter_nth_child(self, parent, n):
+      if(parent is None):
+         return self._create_iter(n)
+      return (False, None)
+
+   def do_iter_parent(self, child):
+      return (False, None)
+
    def add_missing_db_columns(self):
       """ Check whether each field name in AVAILABLE_FIELD_NAMES_ORDERED is in the database table. If not, add it
       (with all entries being set to an empty string initially). """
       logging.debug("Adding any missing database columns...")
 
       # Get all the column names in the current database table.
-      column_names = []
-      try:
-         with self.connection:
-            c = self.connection.cursor()
-            c.execute("PRAGMA table_info(%s)" % self.name) 
-            result = c.fetchall()
-         for t in result:
-            column_names.append(t[1].upper())
-      except (sqlite.Error, IndexError) as e:
-         logging.exception(e)
+      column_names = self.get_column_names()
+      if(column_names is None):
          logging.error("Could not obtain the database column names.")
          return
+      column_names = [column_name.upper() for column_name in column_names]
 
+      altered = False
       for field_name in AVAILABLE_FIELD_NAMES_ORDERED:
          if(not(field_name in column_names)):
             try:
                with self.connection:
-                  c.execute("ALTER TABLE %s ADD COLUMN %s TEXT DEFAULT \"\"" % (self.name, field_name.lower()))
+                  c = self.connection.cursor()
+                  c.execute("ALTER TABLE %s ADD COLUMN %s %s DEFAULT \"\"" % (self.name, field_name.lower(), get_db_column_type(field_name, self.has_typed_columns())))
+               altered = True
             except sqlite.Error as e:
                logging.exception(e)
                logging.error("Could not add the missing database column '%s'." % field_name)
                pass
+      if(altered):
+         # The cached column names (and the queries built from them) are now out-of-date.
+         self.invalidate_schema_cache()
       logging.debug("Finished adding any missing database columns.")
       return
 
+   def add_missing_db_indexes(self):
+      """ Check whether each index in DB_INDEXES exists on the database table. If not, create it. An existing index on the same columns
+      but with a different name (e.g. because the log has been renamed) is re-created with the expected name. """
+      logging.debug("Adding any missing database indexes...")
+
+      # The timestamp column must exist before it can be indexed.
+      self.add_missing_timestamp_column()
+
+      # Get the indexed columns (or expressions) of each index on the current database table, from the SQL statement that created the index.
+      # Note: SQLite's internal indexes (e.g. for the primary key) do not have an SQL statement.
+      existing_indexes = {}
+      try:
+         with self.connection:
+            c = self.connection.cursor()
+            c.execute("SELECT name, sql FROM sqlite_master WHERE type='index' AND tbl_name=? AND sql IS NOT NULL", [self.name])
+            for (index_name, sql) in c.fetchall():
+               existing_indexes[str(index_name)] = self._normalise_index_columns(sql[sql.index("(")+1:sql.rindex(")")])
+      except (sqlite.Error, ValueError) as e:
+         logging.exception(e)
+         logging.error("Could not obtain the database indexes.")
+         return
+
+      for (suffix, columns) in DB_INDEXES:
+         index_name = "%s_%s" % (self.name, suffix)
+         indexed_columns = self._normalise_index_columns(", ".join(columns))
+         if(existing_indexes.get(index_name) == indexed_columns):
+            continue # Nothing to do here.
+         try:
+            with self.connection:
+               c = self.connection.cursor()
+               for (existing_index_name, existing_indexed_columns) in existing_indexes.items():
+                  if(existing_indexed_columns == indexed_columns):
+                     # The index exists, but under a different name.
+                     c.execute("DROP INDEX %s" % existing_index_name)
+               c.execute("CREATE INDEX %s ON %s (%s)" % (index_name, self.name, ", ".join(columns)))
+         except sqlite.Error as e:
+            logging.exception(e)
+            logging.error("Could not add the missing database index '%s'." % index_name)
+      logging.debug("Finished adding any missing database indexes.")
+      return
+
+   def _normalise_index_columns(self, columns):
+      """ Return the column list of an index in a form that can be compared with another one, by ignoring case and white space. """
+      return "".join(columns.lower().split())
+
+   def add_missing_fts_index(self):
+      """ Make sure that the log has a full-text search index over the fields in FTS_FIELD_NAMES, so that it can be searched with the search method.
+      The index is an FTS5 table (or an FTS4 table, if this version of SQLite does not support FTS5) which is kept in sync with the log's database table by triggers.
+      If the index does not exist yet, then it is created and filled with the records that are already in the log.
+      Return True if the index is ready to use, and False otherwise. """
+      if(self._fts_module is not None):
+         return True # Already checked.
+      logging.debug("Adding any missing full-text search index...")
+
+      # The triggers refer to the columns being indexed, so these must exist first.
+      self.add_missing_db_columns()
+
+      fts_table_name = get_fts_table_name(self.name)
+      column_names = [field_name.lower() for field_name in FTS_FIELD_NAMES]
+      triggers = {"%s_fts_insert" % self.name: "AFTER INSERT ON %s BEGIN INSERT INTO %s (rowid, %s) VALUES (new.id, %s); END" % (self.name, fts_table_name, ", ".join(column_names), ", ".join(["new.%s" % column_name for column_name in column_names])),
+                  "%s_fts_update" % self.name: "AFTER UPDATE OF %s ON %s BEGIN UPDATE %s SET %s WHERE rowid=old.id; END" % (", ".join(column_names), self.name, fts_table_name, ", ".join(["%s=new.%s" % (column_name, column_name) for column_name in column_names])),
+                  "%s_fts_delete" % self.name: "AFTER DELETE ON %s BEGIN DELETE FROM %s WHERE rowid=old.id; END" % (self.name, fts_table_name)}
+      try:
+         with self.connection:
+            c = self.connection.cursor()
+            c.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name=?", [fts_table_name])
+            result = c.fetchone()
+            if(result is None):
+               logging.debug("Creating the full-text search index for '%s'..." % self.name)
+               try:
+                  c.execute("CREATE VIRTUAL TABLE %s USING fts5(%s, prefix='2 3')" % (fts_table_name, ", ".join(column_names)))
+                  self._fts_module = "fts5"
+               except sqlite.OperationalError:
+                  c.execute("CREATE VIRTUAL TABLE %s USING fts4(%s, prefix=\"2,3\")" % (fts_table_name, ", ".join(column_names)))
+                  self._fts_module = "fts4"
+               c.execute("INSERT INTO %s (rowid, %s) SELECT id, %s FROM %s" % (fts_table_name, ", ".join(column_names), ", ".join(column_names), self.name))
+            elif("fts5" in result[0].lower()):
+               self._fts_module = "fts5"
+            else:
+               self._fts_module = "fts4"
+
+            self._create_triggers(c, triggers)
+      except sqlite.Error as e:
+         logging.exception(e)
+         logging.error("Could not add the full-text search index to '%s'." % self.name)
+         self._fts_module = None
+         return False
+      logging.debug("Finished adding any missing full-text search index.")
+      return True
+
+   def add_missing_timestamp_column(self):
+      """ Make sure that the log's database table has a TIMESTAMP_COLUMN column, which holds the UTC date and time of each QSO (in seconds since the Unix epoch).
+      This is derived from the QSO_DATE and TIME_ON fields when a record is added or updated, and (unlike those fields) can be used with its index for date and time range queries.
+      If the column does not exist yet, then it is added and filled in for the records that are already in the log. """
+      if(self._timestamp_column_ready):
+         return True # Already checked.
+      logging.debug("Adding any missing timestamp column...")
+
+      # The timestamp is derived from the QSO_DATE and TIME_ON columns, so these must exist first.
+      self.add_missing_db_columns()
+      column_names = self.get_column_names()
+      if(column_names is None):
+         logging.error("Could not obtain the database column names.")
+         return False
+
+      # Note: The timestamp of each new record is calculated by the INSERT query itself (see _get_insert_query), rather than by a trigger which would update the record again.
+      triggers = {"%s_timestamp_update" % self.name: "AFTER UPDATE OF qso_date, time_on ON %s BEGIN UPDATE %s SET %s = %s WHERE id=new.id; END" % (self.name, self.name, TIMESTAMP_COLUMN, get_timestamp_expression("new.qso_date", "new.time_on"))}
+      try:
+         with self.connection:
+            c = self.connection.cursor()
+            if(TIMESTAMP_COLUMN not in [column_name.lower() for column_name in column_names]):
+               logging.debug("Adding the timestamp column to '%s'..." % self.name)
+               c.execute("ALTER TABLE %s ADD COLUMN %s INTEGER" % (self.name, TIMESTAMP_COLUMN))
+               c.execute("UPDATE %s SET %s = %s" % (self.name, TIMESTAMP_COLUMN, get_timestamp_expression()))
+               self.invalidate_schema_cache()
+            self._create_triggers(c, triggers, obsolete_suffixes=["_timestamp_insert"])
+      except sqlite.Error as e:
+         logging.exception(e)
+         logging.error("Could not add the timestamp column to '%s'." % self.name)
+         return False
+      self._timestamp_column_ready = True
+      logging.debug("Finished adding any missing timestamp column.")
+      return True
+
+   def _create_triggers(self, c, triggers, obsolete_suffixes=[]):
+      """ Create the triggers in the dictionary 'triggers' (keyed by trigger name) on the log's database table, using the cursor 'c', unless they exist already.
+      The name of each trigger is the log's name followed by a suffix. Any other triggers on the table with the same suffix are dropped first,
+      since these must have been created before the log was renamed (and so they have the wrong names, and may update the wrong table).
+      Any triggers with a suffix in 'obsolete_suffixes' (i.e. which are no longer needed) are dropped too. """
+      suffixes = [trigger_name[len(self.name):] for trigger_name in triggers.keys()] + obsolete_suffixes
+      c.execute("SELECT name FROM sqlite_master WHERE type='trigger' AND tbl_name=?", [self.name])
+      for trigger_name in [str(t[0]) for t in c.fetchall()]:
+         if(trigger_name not in triggers and any([trigger_name.endswith(suffix) for suffix in suffixes])):
+            c.execute("DROP TRIGGER %s" % trigger_name)
+      for trigger_name in triggers.keys():
+         c.execute("CREATE TRIGGER IF NOT EXISTS %s %s" % (trigger_name, triggers[trigger_name]))
+      return
+
+   def has_typed_columns(self):
+      """ Return True if the log's numeric fields are stored in typed (i.e. REAL or INTEGER) database columns, and False if they are stored as TEXT. """
+      column_types = self.get_column_types()
+      if(column_types is None):
+         return False
+      for field_name in TYPED_DB_COLUMN_TYPES.keys():
+         if(column_types.get(field_name, "TEXT") != TYPED_DB_COLUMN_TYPES[field_name]):
+            return False
+      return True
+
+   def convert_to_typed_columns(self):
+      """ Convert the log's database table to one in which the numeric fields are stored in typed database columns (see TYPED_DB_COLUMN_TYPES).
+      Any data in a numeric field that is not a number is kept as it is. Return True if successful (or if the log already has typed columns), and False otherwise. """
+      for fraction in self.convert_to_typed_columns_incrementally():
+         pass
+      return self.has_typed_columns()
+
+   def convert_to_typed_columns_incrementally(self, chunk_size=CONVERSION_CHUNK_SIZE):
+      """ The same as the convert_to_typed_columns method, except that this is a generator which copies 'chunk_size' records at a time,
+      and yields the fraction of the records that have been copied so far after each chunk. This allows a large log to be converted bit-by-bit (e.g. from an idle handler)
+      without blocking the user interface. Use has_typed_columns afterwards to check whether the conversion was successful.
+
+      SQLite cannot change the type of an existing column, so the records are copied into a new table with the same columns (in order of their index),
+      one chunk per transaction. The new table then replaces the old one in a final transaction, which also copies any records that have been added in the meantime
+      (and leaves out any that have been deleted). """
+      if(self.has_typed_columns()):
+         return
+      logging.debug("Converting '%s' to typed columns..." % self.name)
+
+      self.add_missing_db_columns()
+      try:
+         c = self.connection.cursor()
+         c.execute("PRAGMA table_info(%s)" % self.name)
+         columns = c.fetchall()
+         c.execute("SELECT COUNT(*) FROM %s" % self.name)
+         number_of_records = c.fetchone()[0]
+      except sqlite.Error as e:
+         logging.exception(e)
+         logging.error("Could not obtain the database columns.")
+         return
+      temporary_table_name = "%sconvert_%s" % (INTERNAL_TABLE_PREFIX, self.name)
+      column_names = [str(t[1]) for t in columns]
+      column_definitions = []
+      for (cid, column_name, column_type, not_null, default, primary_key) in columns:
+         if(primary_key):
+            column_definitions.append("%s INTEGER PRIMARY KEY AUTOINCREMENT" % column_name)
+            continue
+         column_type = TYPED_DB_COLUMN_TYPES.get(column_name.upper(), column_type)
+         if(default is not None):
+            column_definitions.append("%s %s DEFAULT %s" % (column_name, column_type, default))
+         else:
+            column_definitions.append("%s %s" % (column_name, column_type))
+      # Inserting the data into the typed columns converts any numbers stored as text into actual numbers.
+      copy_query = "INSERT INTO %s (%s) SELECT %s FROM %%s WHERE id > ? ORDER BY id" % (temporary_table_name, ", ".join(column_names), ", ".join(column_names))
+
+      copied = 0
+      last_index = 0
+      try:
+         with self.connection:
+            c = self.connection.cursor()
+            c.execute("DROP TABLE IF EXISTS %s" % temporary_table_name) # Left over from an earlier conversion that did not finish.
+            c.execute("CREATE TABLE %s (%s)" % (temporary_table_name, ", ".join(column_definitions)))
+         while True:
+            with self.connection:
+               c = self.connection.cursor()
+               c.execute((copy_query % self.name) + " LIMIT ?", [last_index, chunk_size])
+               if(c.rowcount <= 0):
+                  break
+               copied += c.rowcount
+               c.execute("SELECT MAX(id) FROM %s" % temporary_table_name)
+               last_index = c.fetchone()[0]
+            yield min(float(copied)/max(number_of_records, 1), 1.0)
+      except sqlite.Error as e:
+         logging.exception(e)
+         logging.error("Could not convert '%s' to typed columns." % self.name)
+         return
+
+      # Dropping and renaming tables would otherwise commit the transaction part-way through, so handle the transaction explicitly.
+      isolation_level = self.connection.isolation_level
+      self.connection.isolation_level = None
+      try:
+         c.execute("BEGIN")
+         c.execute(copy_query % self.name, [last_index])
+         c.execute("DELETE FROM %s WHERE id NOT IN (SELECT id FROM %s)" % (temporary_table_name, self.name))
+         c.execute("SELECT seq FROM sqlite_sequence WHERE name=?", [self.name])
+         sequence = c.fetchone()
+         c.execute("DROP TABLE %s" % self.name) # This drops the table's indexes and triggers too. They are re-created below.
+         c.execute("ALTER TABLE %s RENAME TO %s" % (temporary_table_name, self.name))
+         if(sequence is not None):
+            # Make sure that the indices of any deleted records are not re-used.
+            c.execute("UPDATE sqlite_sequence SET seq=? WHERE name=?", [sequence[0], self.name])
+         c.execute("COMMIT")
+      except sqlite.Error as e:
+         logging.exception(e)
+         logging.error("Could not convert '%s' to typed columns." % self.name)
+         try:
+            c.execute("ROLLBACK")
+         except sqlite.Error:
+            pass
+         return
+      finally:
+         self.connection.isolation_level = isolation_level
+
+      self.invalidate_schema_cache()
+      self.pages.clear()
+      self.add_missing_timestamp_column()
+      self.add_missing_db_indexes()
+      self.add_missing_fts_index()
+      logging.debug("Finished converting '%s' to typed columns." % self.name)
+      yield 1.0
+      return
+
+   def get_column_names(self):
+      """ Return a list of the column names in the log's database table, or None if there is a database error.
+      The column names are cached after the first call, until invalidate_schema_cache is called. """
+      if(self._column_names is None):
+         try:
+            with self.connection:
+               c = self.connection.cursor()
+               c.execute("PRAGMA table_info(%s)" % self.name)
+               result = c.fetchall()
+            self._column_names = [str(t[1]) for t in result]
+            self._column_types = dict([(str(t[1]).upper(), str(t[2]).upper()) for t in result])
+         except (sqlite.Error, IndexError) as e:
+            logging.exception(e)
+            return None
+      return self._column_names
+
+   def get_column_types(self):
+      """ Return a dictionary of the declared type of each column in the log's database table (keyed by the upper case column name), or None if there is a database error.
+      Like the column names, these are cached until invalidate_schema_cache is called. """
+      if(self.get_column_names() is None):
+         return None
+      return self._column_types
+
+   def _get_select_columns(self, table_name=None):
+      """ Return the (cached) list of columns to select when retrieving whole records from the log's database table, in which any typed columns are converted back to text.
+      This means that the fields of a record are always strings (or None), regardless of how they are stored. Numbers in REAL columns are converted without
+      any trailing zeros (e.g. a power of 100 is "100" rather than "100.0"). If 'table_name' is given, then the column names are qualified with it. """
+      if(self._select_columns is None):
+         column_names = self.get_column_names()
+         if(column_names is None):
+            return "*"
+         column_types = self.get_column_types()
+         select_columns = []
+         for column_name in column_names:
+            if(column_name.upper() in AVAILABLE_FIELD_NAMES_ORDERED and column_types[column_name.upper()] == "REAL"):
+               # Whole numbers are stored as e.g. 100.0 in a REAL column, so convert these back to e.g. "100" rather than "100.0".
+               select_columns.append("CASE WHEN typeof(%%(table)s%s)='real' AND %%(table)s%s = CAST(%%(table)s%s AS INTEGER) THEN CAST(CAST(%%(table)s%s AS INTEGER) AS TEXT) ELSE CAST(%%(table)s%s AS TEXT) END AS %s" % ((column_name,)*6))
+            elif(column_name.upper() in AVAILABLE_FIELD_NAMES_ORDERED and column_types[column_name.upper()] != "TEXT"):
+               select_columns.append("CAST(%%(table)s%s AS TEXT) AS %s" % (column_name, column_name))
+            else:
+               select_columns.append("%%(table)s%s" % column_name)
+         self._select_columns = ", ".join(select_columns)
+      if(self._select_columns == "*"):
+         return "*"
+      if(table_name is None):
+         return self._select_columns % {"table": ""}
+      else:
+         return self._select_columns % {"table": table_name + "."}
+
+   def invalidate_schema_cache(self):
+      """ Forget the cached database column names and SQL queries. This must be called whenever the log's database table is altered or renamed. """
+      self._column_names = None
+      self._column_types = None
+      self._select_columns = None
+      self._insert_query = None
+      self._update_queries = {}
+      self._fts_module = None
+      self._timestamp_column_ready = False
+      return
+
+   def _get_insert_query(self):
+      """ Return a tuple containing the (cached) parameterised INSERT query for the log's database table, and the list of field names
+      whose data should be supplied (in order) as the query's parameters. Return (None, None) if there is a database error. """
+      if(self._insert_query is None):
+         # What if the database columns are not necessarily in the same order as (or even exist in) AVAILABLE_FIELD_NAMES_ORDERED?
+         # PyQSO handles this here by naming the columns explicitly in the query.
+         all_column_names = self.get_column_names()
+         if(all_column_names is None):
+            return (None, None)
+         column_names = [column_name for column_name in all_column_names if column_name.upper() in AVAILABLE_FIELD_NAMES_ORDERED]
+         field_names = [column_name.upper() for column_name in column_names]
+         # The parameters are numbered so that the QSO_DATE and TIME_ON parameters can also be used to calculate the timestamp column (if there is one).
+         values = ["?%d" % (i+1) for i in range(len(column_names))]
+         if(TIMESTAMP_COLUMN in [column_name.lower() for column_name in all_column_names] and "QSO_DATE" in field_names and "TIME_ON" in field_names):
+            column_names.append(TIMESTAMP_COLUMN)
+            values.append(get_timestamp_expression(values[field_names.index("QSO_DATE")], values[field_names.index("TIME_ON")]))
+         query = "INSERT INTO %s (%s) VALUES (%s)" % (self.name, ", ".join(column_names), ", ".join(values))
+         self._insert_query = (query, field_names)
+      return self._insert_query
+
    def add_record(self, fields_and_data):
       """ Add a record comprising data given in the 'fields_and_data' argument to the log. """
       logging.debug("Adding record to log...")
-      liststore_entry = []
-      field_names = AVAILABLE_FIELD_NAMES_ORDERED
-      for i in range(0, len(field_names)):
-         if(field_names[i] in fields_and_data.keys()):
-            liststore_entry.append(fields_and_data[field_names[i]])
-         else:
-            liststore_entry.append("")
+
+      (query, query_field_names) = self._get_insert_query()
+      if(query is None):
+         logging.error("Could not add the record to the log.")
+         return
 
       try:
          with self.connection:
             c = self.connection.cursor()
-            # What if the database columns are not necessarily in the same order as (or even exist in) AVAILABLE_FIELD_NAMES_ORDERED?
-            # PyQSO handles this here, but needs a separate list (called database_entry) to successfully perform the SQL query.
-            database_entry = []
-            c.execute("PRAGMA table_info(%s)" % self.name) # Get all the column names in the current database table.
-            column_names = c.fetchall()
-            query = "INSERT INTO %s VALUES (NULL" % self.name
-            for t in column_names:
-               # 't' here is a tuple
-               column_name = str(t[1])
-               if( (column_name.upper() in AVAILABLE_FIELD_NAMES_ORDERED) and (column_name.upper() in fields_and_data.keys()) ):
-                  database_entry.append(fields_and_data[column_name.upper()])
-                  query = query + ",?"
-               else:
-                  if(column_name != "id"): # Ignore the row index field. This is a special case since it's not in AVAILABLE_FIELD_NAMES_ORDERED.
-                     query = query + ",\"\""
-            query = query + ")"
-            c.execute(query, database_entry)
+            c.execute(query, [fields_and_data.get(field_name, "") for field_name in query_field_names])
             index = c.lastrowid
 
-         liststore_entry.insert(0, index) # Add the record's index.
-         self.append(liststore_entry)
+         # Add the record's index to the end of the log (regardless of how the log is sorted). The rest of the record will be fetched from the database when it is displayed.
+         # If the Log has not finished being populated yet, then the new record is added after the records that are still to be added.
+         if(self._matches_callsign_filter(fields_and_data)):
+            if(self.populated):
+               self.rowids.append(index)
+               position = len(self.rowids)-1
+               self._discard_pages(position)
+               path = Gtk.TreePath(position)
+               self.row_inserted(path, self.get_iter(path))
+            else:
+               self.pending_rowids.append(index)
          logging.debug("Successfully added the record to the log.")
       except (sqlite.Error, IndexError) as e:
          logging.exception(e)
          logging.error("Could not add the record to the log.")
       return
 
+   def add_records(self, records, batch_size=BATCH_SIZE):
+      """ Add all the records in the iterable 'records' to the log. Each record comprises the field-value pairs of a single QSO, e.g. {FREQ:145.500, BAND:2M, MODE:FM}.
+      The records are inserted using a single prepared query, in transactions of 'batch_size' records at a time, and the Log is re-populated
+      just once at the end. This is much faster than calling add_record for each record, and is intended for bulk operations such as importing a log.
+      Return the number of records that were successfully added. """
+      logging.debug("Adding records to log...")
+
+      # Resolve the database column layout once, rather than once per record.
+      (query, field_names) = self._get_insert_query()
+      if(query is None):
+         logging.error("Could not add the records to the log.")
+         return 0
+
+      added = 0
+      records = iter(records)
+      while True:
+         batch = []
+         for fields_and_data in islice(records, batch_size):
+            batch.append([fields_and_data.get(field_name, "") for field_name in field_names])
+         if(len(batch) == 0):
+            break
+         try:
+            with self.connection:
+               c = self.connection.cursor()
+               c.executemany(query, batch)
+            added += len(batch)
+         except sqlite.Error as e:
+            logging.exception(e)
+            logging.error("Could not add a batch of %d records to the log." % len(batch))
+
+      # Refresh the Log in one go.
+      self.populate()
+      logging.debug("Successfully added %d record(s) to the log." % added)
+      return added
+
+   def get_import_checkpoint(self, path, file_hash):
+      """ Return a tuple containing the position in the file just after the last committed record, and the number of records committed so far,
+      for an unfinished import of the ADIF file with a given path into this log. Return None if there is no unfinished import of the file,
+      or if the file has changed (i.e. its hash is not 'file_hash') since the import started. """
+      try:
+         with self.connection:
+            c = self.connection.cursor()
+            create_checkpoint_table(c)
+            c.execute("SELECT file_hash, position, records FROM %s WHERE log_name=? AND path=?" % CHECKPOINT_TABLE, [self.name, path])
+            checkpoint = c.fetchone()
+      except sqlite.Error as e:
+         logging.exception(e)
+         return None
+      if(checkpoint is None or checkpoint[0] != file_hash):
+         return None
+      return (checkpoint[1], checkpoint[2])
+
+   def remove_import_checkpoint(self, path):
+      """ Forget about any unfinished import of the ADIF file with a given path into this log, e.g. so that it can be imported again from the start. """
+      try:
+         with self.connection:
+            c = self.connection.cursor()
+            create_checkpoint_table(c)
+            c.execute("DELETE FROM %s WHERE log_name=? AND path=?" % CHECKPOINT_TABLE, [self.name, path])
+      except sqlite.Error as e:
+         logging.exception(e)
+      return
+
+   def import_records(self, records, path, file_hash, batch_size=BATCH_SIZE, progress=None):
+      """ Add the records being read from the ADIF file with a given path (and hash, from get_file_hash) to the log, using the run_import function.
+      If there is a checkpoint for the file, then the records are assumed to follow on from it. The Log is re-populated once at the end.
+      Return a tuple containing the number of records that were added, and True if the import is complete (False otherwise). """
+      (query, field_names) = self._get_insert_query()
+      if(query is None):
+         logging.error("Could not import the records into the log.")
+         return (0, False)
+      checkpoint = self.get_import_checkpoint(path, file_hash)
+      total = 0 if checkpoint is None else checkpoint[1]
+      result = run_import(self.connection, self.name, query, field_names, records, path, file_hash, total=total, batch_size=batch_size, progress=progress)
+      self.populate()
+      return result
+
+   def add_imported_records(self, after_index, last_index):
+      """ Add the records with indices greater than 'after_index' and no greater than 'last_index', which have just been added to the database by
+      something else (e.g. an import running in another thread), to the end of the Log, in the same way as add_record does. Only the records that match
+      the callsign filter are added. Nothing is done if the Log is not fully populated, since populating it will pick up the new records anyway. """
+      if(not self.populated):
+         return
+      (conditions, parameters) = self._get_callsign_filter_conditions()
+      query = "SELECT id FROM %s WHERE " % self.name + " AND ".join(["id > ?", "id <= ?"] + conditions) + " ORDER BY id"
+      try:
+         with self.connection:
+            c = self.connection.cursor()
+            c.execute(query, [after_index, last_index] + parameters)
+            rowids = [row[0] for row in c]
+      except sqlite.Error as e:
+         logging.exception(e)
+         return
+      for rowid in rowids:
+         self.rowids.append(rowid)
+         position = len(self.rowids)-1
+         self._discard_pages(position)
+         path = Gtk.TreePath(position)
+         self.row_inserted(path, self.get_iter(path))
+      return
+
    def delete_record(self, index, iter=None):
-      """ Delete a record with a specific index in the SQL database. The corresponding record is also deleted from the Gtk.ListStore data structure. Note that iter should always be given. It is given a default value of None for unit testing purposes only. """
+      """ Delete a record with a specific index in the SQL database. The corresponding row is also removed from the Log. Note that iter should always be given. It is given a default value of None for unit testing purposes only. """
       logging.debug("Deleting record from log...")
       # Get the selected row in the logbook
       try:
@@ -146,8 +952,15 @@ class Log(Gtk.ListStore):
             c = self.connection.cursor()
             query = "DELETE FROM %s" % self.name
             c.execute(query+" WHERE id=?", [index])
-         if(iter is not None):
-            self.remove(iter)
+         position = self._find_position(index, iter)
+         if(position is not None):
+            self.rowids.pop(position)
+            # All the rows after this one move up by one, so the pages containing them are out-of-date.
+            self._discard_pages(position, following=True)
+            self.row_deleted(Gtk.TreePath(position))
+         elif(index in self.pending_rowids):
+            # The Log is still being populated, and this record has not been added to it yet.
+            self.pending_rowids.remove(index)
          logging.debug("Successfully deleted the record from the log.")
       except (sqlite.Error, IndexError) as e:
          logging.exception(e)
@@ -160,48 +973,58 @@ class Log(Gtk.ListStore):
       try:
          with self.connection:
             c = self.connection.cursor()
-            query = "UPDATE %s SET %s" % (self.name, field_name)
-            query = query + "=? WHERE id=?"
+            if(field_name not in self._update_queries):
+               self._update_queries[field_name] = "UPDATE %s SET %s=? WHERE id=?" % (self.name, field_name)
+            query = self._update_queries[field_name]
             c.execute(query, [data, index]) # First update the SQL database...
          if(iter is not None and column_index is not None):
-            self.set(iter, column_index, data) # ...and then the ListStore.
+            # ...and then tell the TreeView to re-fetch the row.
+            position = self._get_position(iter)
+            self._discard_pages(position)
+            self.row_changed(Gtk.TreePath(position), iter)
          logging.debug("Successfully edited field '%s' in record %d in the log." % (field_name, index))
       except (sqlite.Error, IndexError) as e:
          logging.exception(e)
          logging.error("Could not edit field %s in record %d in the log." % (field_name, index))
       return
 
+   def _find_position(self, index, iter=None):
+      """ Return the position of the row holding the record with a given index, or None if the record is not in the Log.
+      If a Gtk.TreeIter pointing at the row is given, then this is used instead of searching through the Log. """
+      if(iter is not None):
+         return self._get_position(iter)
+      try:
+         return self.rowids.index(index)
+      except ValueError:
+         return None
+
    def remove_duplicates(self):
       """ Find the duplicates in the log, based on the CALL, QSO_DATE, TIME_ON, FREQ and MODE fields. Return a tuple containing the number of duplicates in the log, and the number of duplicates successfully removed. Hopefully these will be the same. """
-      duplicates = []
+      # The first record (i.e. the one with the lowest index) in each group of identical records is kept. The rest are duplicates.
+      duplicates_query = "SELECT MIN(rowid) FROM %s GROUP BY call, qso_date, time_on, freq, mode" % self.name
       try:
          with self.connection:
             c = self.connection.cursor()
-            c.execute(
-   """SELECT rowid FROM %s WHERE rowid NOT IN
-   (
-   SELECT MIN(rowid) FROM %s GROUP BY call, qso_date, time_on, freq, mode
-   )""" % (self.name, self.name))
-            result = c.fetchall()
-         for rowid in result:
-            duplicates.append(rowid[0]) # Get the integer from inside the tuple.
-         if(len(duplicates) == 0):
-            return (0, 0) # Nothing to do here.
+            c.execute("SELECT rowid FROM %s WHERE rowid NOT IN (%s)" % (self.name, duplicates_query))
+            duplicates = set([rowid[0] for rowid in c.fetchall()]) # Get the integer from inside each tuple.
+            if(len(duplicates) == 0):
+               return (0, 0) # Nothing to do here.
+            # Delete all the duplicates at once, in the same transaction.
+            c.execute("DELETE FROM %s WHERE rowid NOT IN (%s)" % (self.name, duplicates_query))
+            removed = c.rowcount # Count the number of records that are removed. Hopefully this will be the same as len(duplicates).
       except (sqlite.Error, IndexError) as e:
          logging.exception(e)
          return (0, 0)
 
-      removed = 0 # Count the number of records that are removed. Hopefully this will be the same as len(duplicates).
-      path = Gtk.TreePath(0) # Start with the first row in the log.
-      iter = self.get_iter(path)
-      while iter is not None:
-         row_index = self.get_value(iter, 0) # Get the index.
-         if(row_index in duplicates): # Is this a duplicate row? If so, delete it.
-            self.delete_record(row_index, iter)
-            removed += 1
-         iter = self.iter_next(iter) # Move on to the next row, until iter_next returns None.
-
-      assert(len(duplicates) == removed)
+      # Now remove the duplicates from the Log in one pass.
+      # Start with the last row in the log, so that removing a row does not change the position of the rows that are still to be checked.
+      for position in reversed(xrange(len(self.rowids))):
+         if(self.rowids[position] in duplicates):
+            self.rowids.pop(position)
+            self.row_deleted(Gtk.TreePath(position))
+      self.pages.clear()
+      self.pending_rowids = array("l", [rowid for rowid in self.pending_rowids if rowid not in duplicates])
+
       return (len(duplicates), removed)
 
    def get_record_by_index(self, index):
@@ -209,7 +1032,7 @@ class Log(Gtk.ListStore):
       try:
          with self.connection:
             c = self.connection.cursor()
-            query = "SELECT * FROM %s WHERE id=?" % self.name
+            query = "SELECT %s FROM %s WHERE id=?" % (self._get_select_columns(), self.name)
             c.execute(query, [index])
             return c.fetchone()
       except sqlite.Error as e:
@@ -217,12 +1040,148 @@ class Log(Gtk.ListStore):
          return None
 
    def get_all_records(self):
-      """ Return a list of all the records in the log. Each record is represented by a dictionary. """
+      """ Return a list of all the records in the log. Each record is represented by a dictionary.
+      Note that this holds every record in memory at once. Use the query method to go through the records one at a time instead. """
+      records = self.query()
+      if(records is None):
+         return None
+      return list(records)
+
+   def query(self, where=None, date_from=None, date_to=None, bands=None, modes=None, order_by=None, descending=False, limit=None, offset=None, page_size=QUERY_PAGE_SIZE):
+      """ Return an iterator over the records in the log that match all of the given criteria, or None if the criteria are not valid or there is a database error.
+      The records are fetched from the database 'page_size' records at a time as the iterator is advanced, so a large number of records can be gone through
+      without holding them all in memory. Each record is represented by a dictionary, as in get_all_records.
+
+      'where' is a dictionary of field-value pairs that the records must match exactly (e.g. {"CALL":"M0ABC"}).
+      'date_from' and 'date_to' are ADIF dates (YYYYMMDD) giving the first and last days (inclusive, in UTC) of the QSOs to return. These use the index on the timestamp column.
+      'bands' and 'modes' are lists of the bands and modes (ignoring case) that the records must be on.
+      'order_by' is the name of the field to sort the records by (see get_sort_expressions), or None to sort them by their indices. If 'descending' is True, then the order is reversed.
+      'limit' is the maximum number of records to return, after skipping the first 'offset' records.
+
+      Each page is fetched with a separate query, so no database cursor (or lock) is held between pages, and the database can be modified while the iterator is in use
+      (e.g. by a background import). When the records are ordered by their indices, each page carries on from the index of the last record in the previous page. """
+      conditions = []
+      parameters = []
+      try:
+         if(where is not None):
+            for field_name in where.keys():
+               if(not(field_name.upper() in AVAILABLE_FIELD_NAMES_ORDERED)):
+                  raise ValueError("Unknown field name '%s'." % field_name)
+               conditions.append("%s = ?" % field_name.lower())
+               parameters.append(where[field_name])
+         if(date_from is not None):
+            conditions.append("%s >= ?" % TIMESTAMP_COLUMN)
+            parameters.append(calendar.timegm(datetime.strptime(date_from, "%Y%m%d").timetuple()))
+         if(date_to is not None):
+            # Include all of the last day.
+            conditions.append("%s < ?" % TIMESTAMP_COLUMN)
+            parameters.append(calendar.timegm((datetime.strptime(date_to, "%Y%m%d") + timedelta(days=1)).timetuple()))
+         if(bands is not None):
+            conditions.append("lower(band) IN (%s)" % ", ".join(["?"]*len(bands)))
+            parameters.extend([band.lower() for band in bands])
+         if(modes is not None):
+            conditions.append("upper(mode) IN (%s)" % ", ".join(["?"]*len(modes)))
+            parameters.extend([mode.upper() for mode in modes])
+         if(order_by is not None and not(order_by.upper() in AVAILABLE_FIELD_NAMES_ORDERED)):
+            raise ValueError("Unknown field name '%s'." % order_by)
+      except ValueError as e:
+         logging.exception(e)
+         logging.error("Could not query '%s' because the query is not valid." % self.name)
+         return None
+
+      if((date_from is not None or date_to is not None) and not self.add_missing_timestamp_column()):
+         return None
+      if(order_by is not None):
+         order_by = order_by.upper()
+
+      # Fetch the first page now, so that any database error can be reported by returning None.
+      try:
+         records = self._get_query_page(conditions, parameters, order_by, descending, None, offset if offset is not None else 0, page_size if limit is None else min(limit, page_size))
+      except sqlite.Error as e:
+         logging.exception(e)
+         logging.error("Could not query '%s' because of a database error." % self.name)
+         return None
+      return self._iter_query_pages(records, conditions, parameters, order_by, descending, limit, offset if offset is not None else 0, page_size)
+
+   def _get_query_page(self, conditions, parameters, order_by, descending, last_index, offset, count):
+      """ Return a list of up to 'count' records that match the 'conditions' (with the given 'parameters'), in the order given by 'order_by' and 'descending',
+      after skipping the first 'offset' of them. If 'last_index' is not None, then only the records which come after the record with this index are considered
+      (this is only valid when the records are ordered by their indices). """
+      conditions = list(conditions)
+      parameters = list(parameters)
+      if(last_index is not None):
+         conditions.append("id %s ?" % ("<" if descending else ">"))
+         parameters.append(last_index)
+      query = "SELECT %s FROM %s" % (self._get_select_columns(), self.name)
+      if(len(conditions) > 0):
+         query = query + " WHERE " + " AND ".join(conditions)
+      direction = " DESC" if descending else ""
+      query = query + " ORDER BY " + ", ".join([expression + direction for expression in self.get_sort_expressions(order_by)]) + " LIMIT ? OFFSET ?"
+      with self.connection:
+         c = self.connection.cursor()
+         c.execute(query, parameters + [count, offset])
+         return c.fetchall()
+
+   def _iter_query_pages(self, records, conditions, parameters, order_by, descending, limit, offset, page_size):
+      """ Yield the records in the first page of a query (from the query method), and then in each of the following pages in turn. """
+      returned = 0
+      while(len(records) > 0):
+         for record in records:
+            yield record
+         returned += len(records)
+         count = page_size if limit is None else min(limit - returned, page_size)
+         if(len(records) < page_size or count <= 0):
+            break # That was the last page.
+         try:
+            if(order_by is None):
+               records = self._get_query_page(conditions, parameters, order_by, descending, records[-1]["id"], 0, count)
+            else:
+               records = self._get_query_page(conditions, parameters, order_by, descending, None, offset + returned, count)
+         except sqlite.Error as e:
+            logging.exception(e)
+            logging.error("Could not query '%s' because of a database error." % self.name)
+            break
+      return
+
+   def get_worked_counts(self):
+      """ Return a list of (callsign, band, mode, DXCC entity, count) tuples giving the number of records in the log for each combination of callsign, band, mode
+      and DXCC entity, or None if there is a database error. The callsign and mode are in upper case, the band is in lower case, and the DXCC entity is a string
+      (or None if it is unknown). Records without a band or mode are not counted. """
+      try:
+         with self.connection:
+            c = self.connection.cursor()
+            c.execute("""SELECT upper(call), lower(band), upper(mode), CAST(dxcc AS TEXT), COUNT(*) FROM %s
+   WHERE band IS NOT NULL AND mode IS NOT NULL AND mode != ""
+   GROUP BY upper(call), lower(band), upper(mode), CAST(dxcc AS TEXT)""" % self.name)
+            return [tuple(row) for row in c.fetchall()]
+      except sqlite.Error as e:
+         logging.exception(e)
+         return None
+
+   def search(self, text, limit=SEARCH_PAGE_SIZE, offset=0):
+      """ Search the fields in FTS_FIELD_NAMES for some text (see get_fts_query), using the log's full-text search index.
+      Return a list of (rank, record) tuples for the 'limit' best matching records (after skipping the first 'offset' of them), best match first.
+      A lower rank means a better match. Return None if there is a database error. """
+      query = get_fts_query(text)
+      if(query is None):
+         return []
+      if(not self.add_missing_fts_index()):
+         return None
+
+      fts_table_name = get_fts_table_name(self.name)
+      if(self._fts_module == "fts5"):
+         # Use FTS5's built-in BM25 ranking.
+         rank = "%s.rank" % fts_table_name
+      else:
+         # FTS4 does not rank the matches itself, so rank them by the number of times the search terms appear in the record.
+         # (The offsets function returns four integers for each match.)
+         rank = "-(length(offsets(%s)) - length(replace(offsets(%s), ' ', '')) + 1)/4" % (fts_table_name, fts_table_name)
       try:
          with self.connection:
             c = self.connection.cursor()
-            c.execute("SELECT * FROM %s" % self.name)
-            return c.fetchall()
+            c.execute("""SELECT %s, %s FROM %s JOIN %s ON %s.id = %s.rowid
+   WHERE %s MATCH ? ORDER BY 1, %s.id LIMIT ? OFFSET ?""" % (rank, self._get_select_columns(self.name), fts_table_name, self.name, self.name, fts_table_name, fts_table_name, self.name), [query, limit, offset])
+            return [(row[0], row) for row in c.fetchall()]
       except sqlite.Error as e:
          logging.exception(e)
          return None
@@ -286,6 +1245,181 @@ class TestLog(unittest.TestCase):
       for field_name in AVAILABLE_FIELD_NAMES_ORDERED:
          assert(field_name in column_names_after)
 
+   def test_log_add_missing_db_indexes(self):
+      self.log.add_missing_db_indexes()
+      c = self.connection.cursor()
+      c.execute("PRAGMA index_list(test)")
+      index_names = [t[1] for t in c.fetchall()]
+      print "Index names: ", index_names
+      assert("test_duplicate_key" in index_names)
+      assert("test_call" in index_names)
+      assert("test_freq" in index_names)
+
+      # Renaming the table should result in the indexes being re-created with the new name.
+      c.execute("ALTER TABLE test RENAME TO test2")
+      self.log.name = "test2"
+      self.log.add_missing_db_indexes()
+      c.execute("PRAGMA index_list(test2)")
+      index_names = [t[1] for t in c.fetchall()]
+      print "Index names after renaming: ", index_names
+      assert(sorted(index_names) == sorted(["test2_%s" % suffix for (suffix, columns) in DB_INDEXES]))
+
+      # The duplicate detection query should now use the index.
+      c.execute("EXPLAIN QUERY PLAN SELECT MIN(rowid) FROM test2 GROUP BY call, qso_date, time_on, freq, mode")
+      plan = " ".join([str(t[-1]) for t in c.fetchall()])
+      print "Query plan: ", plan
+      assert("test2_duplicate_key" in plan)
+
+   def test_log_schema_cache(self):
+      column_names_before = self.log.get_column_names()
+      self.log.add_missing_db_columns() # This alters the table, so the cached column names should be refreshed.
+      column_names_after = self.log.get_column_names()
+      print "Column names before: ", column_names_before
+      print "Column names after: ", column_names_after
+      assert(len(column_names_before) == len(self.field_names) + 1)
+      assert(len(column_names_after) == len(AVAILABLE_FIELD_NAMES_ORDERED) + 1)
+
+      # The cached INSERT query should now include the new columns.
+      self.log.add_record({"CALL":"TEST123", "NOTES":"Test notes"})
+      c = self.connection.cursor()
+      c.execute("SELECT * FROM test")
+      records = c.fetchall()
+      assert(records[0]["NOTES"] == "Test notes")
+
+   def test_log_populate(self):
+      query = "INSERT INTO test VALUES (NULL, ?, ?, ?, ?, ?, ?, ?, ?)"
+      c = self.connection.cursor()
+      for i in range(0, PAGE_SIZE + 5):
+         c.execute(query, ("TEST%d" % i, self.fields_and_data["QSO_DATE"], self.fields_and_data["TIME_ON"], self.fields_and_data["FREQ"], self.fields_and_data["BAND"], self.fields_and_data["MODE"], self.fields_and_data["RST_SENT"], self.fields_and_data["RST_RCVD"]))
+
+      self.log.populate()
+      assert(self.log.iter_n_children(None) == PAGE_SIZE + 5)
+      # Only the index of each record should be in memory until a record's data is requested.
+      assert(len(self.log.pages) == 0)
+      assert(self.log.populated)
+
+      # Fetch a record from the second page.
+      iter = self.log.get_iter(Gtk.TreePath(PAGE_SIZE + 1))
+      assert(self.log.get_value(iter, 0) == PAGE_SIZE + 2)
+      assert(self.log.get_value(iter, 1) == "TEST%d" % (PAGE_SIZE + 1))
+      assert(len(self.log.pages) == 1)
+
+      # Deleting a record should shift the following rows up by one.
+      self.log.delete_record(PAGE_SIZE + 1)
+      iter = self.log.get_iter(Gtk.TreePath(PAGE_SIZE))
+      assert(self.log.get_value(iter, 1) == "TEST%d" % (PAGE_SIZE + 1))
+      assert(self.log.iter_n_children(None) == PAGE_SIZE + 4)
+
+   def test_log_populate_incrementally(self):
+      query = "INSERT INTO test VALUES (NULL, ?, ?, ?, ?, ?, ?, ?, ?)"
+      c = self.connection.cursor()
+      for i in range(0, 5):
+         c.execute(query, ("TEST%d" % i, self.fields_and_data["QSO_DATE"], self.fields_and_data["TIME_ON"], self.fields_and_data["FREQ"], self.fields_and_data["BAND"], self.fields_and_data["MODE"], self.fields_and_data["RST_SENT"], self.fields_and_data["RST_RCVD"]))
+
+      chunks = list(self.log.populate_incrementally(chunk_size=2))
+      print "Number of records after each chunk: ", chunks
+      assert(chunks == [2, 4, 5])
+      assert(self.log.populated)
+      assert(list(self.log.rowids) == [1, 2, 3, 4, 5])
+
+   def test_log_sort(self):
+      query = "INSERT INTO test VALUES (NULL, ?, ?, ?, ?, ?, ?, ?, ?)"
+      c = self.connection.cursor()
+      for (callsign, qso_date, time_on, freq) in [("TEST1", "20130312", "1234", "14.200"), ("test2", "20130311", "2359", "7.100"), ("TEST3", "20130312", "0900", "145.500"), ("TEST4", "20130312", "0900", "")]:
+         c.execute(query, (callsign, qso_date, time_on, freq, self.fields_and_data["BAND"], self.fields_and_data["MODE"], self.fields_and_data["RST_SENT"], self.fields_and_data["RST_RCVD"]))
+      self.log.populate()
+
+      # Frequencies should be sorted numerically rather than alphabetically.
+      assert(self.log.sort("FREQ"))
+      assert(list(self.log.rowids) == [4, 2, 1, 3])
+      assert(self.log.get_value(self.log.get_iter(Gtk.TreePath(1)), 1) == "test2")
+
+      # Dates should be sorted chronologically (i.e. by date and then time). Ties are broken by the index.
+      assert(self.log.sort("QSO_DATE", descending=True))
+      assert(list(self.log.rowids) == [1, 4, 3, 2])
+
+      # An unpopulated log should be populated in the new sort order.
+      self.log.populated = False
+      assert(not self.log.sort("CALL"))
+      self.log.populate()
+      assert(list(self.log.rowids) == [1, 2, 3, 4])
+      self.log.sort(None, descending=True)
+      assert(list(self.log.rowids) == [4, 3, 2, 1])
+
+      # The database should use the indexes to sort the records.
+      c.execute("EXPLAIN QUERY PLAN SELECT id FROM test ORDER BY %s" % ", ".join(self.log.get_sort_expressions("FREQ")))
+      plan = " ".join([str(t[-1]) for t in c.fetchall()])
+      print "Query plan: ", plan
+      assert("test_freq" in plan)
+
+   def test_log_typed_columns(self):
+      query = "INSERT INTO test VALUES (NULL, ?, ?, ?, ?, ?, ?, ?, ?)"
+      c = self.connection.cursor()
+      for (qso_date, time_on, freq) in [("20130312", "1234", "14.200"), ("20130311", "235959", "7.100"), ("20130312", "", "")]:
+         c.execute(query, (self.fields_and_data["CALL"], qso_date, time_on, freq, self.fields_and_data["BAND"], self.fields_and_data["MODE"], self.fields_and_data["RST_SENT"], self.fields_and_data["RST_RCVD"]))
+      c.execute("DELETE FROM test WHERE id=3")
+      self.connection.commit()
+      assert(not self.log.has_typed_columns())
+
+      # Convert the log one record at a time. Records that are added (or deleted) part-way through should be copied (or left out) too.
+      converter = self.log.convert_to_typed_columns_incrementally(chunk_size=1)
+      assert(next(converter) == 0.5)
+      self.log.add_record({"CALL":"TEST789", "QSO_DATE":"20130312", "TIME_ON":"1300", "FREQ":"7.000"})
+      c.execute("DELETE FROM test WHERE id=1")
+      self.connection.commit()
+      fractions = list(converter)
+      print "Fraction of records copied after each chunk: ", fractions
+      assert(fractions[-1] == 1.0)
+      assert(self.log.has_typed_columns())
+      c.execute("SELECT id, typeof(freq), qso_timestamp FROM test")
+      rows = [tuple(row) for row in c.fetchall()]
+      print "Converted rows: ", rows
+      assert(rows == [(2, "real", 1363046399), (4, "real", 1363093200)])
+      assert(self.log.convert_to_typed_columns()) # Nothing more to do.
+
+      # Fields should still be retrieved as text, without any trailing zeros.
+      self.log.add_record({"CALL":"TEST456", "QSO_DATE":"20130313", "TIME_ON":"0000", "FREQ":"145.500", "TX_PWR":"100", "DXCC":"223"})
+      record = self.log.get_record_by_index(5) # The index of the deleted record should not have been re-used.
+      assert(record["FREQ"] == "145.5")
+      assert(record["TX_PWR"] == "100")
+      assert(record["DXCC"] == "223")
+      assert(record["QSO_TIMESTAMP"] == 1363132800)
+      assert(self.log.get_record_by_index(4)["FREQ"] == "7")
+      # The timestamp of a new record is calculated by the INSERT query, so only the update trigger should be needed.
+      c.execute("SELECT name FROM sqlite_master WHERE type='trigger' AND name LIKE 'test_timestamp_%'")
+      assert([str(row[0]) for row in c.fetchall()] == ["test_timestamp_update"])
+
+      # The timestamp should be kept up-to-date, and range queries should use the index.
+      self.log.edit_record(5, "QSO_DATE", "20130314")
+      c.execute("SELECT id FROM test WHERE qso_timestamp >= ? AND qso_timestamp < ?", [1363132800, 1363219200]) # All the QSOs on 2013-03-13.
+      assert(c.fetchall() == [])
+      c.execute("SELECT id FROM test WHERE qso_timestamp >= ? AND qso_timestamp < ?", [1363219200, 1363305600]) # All the QSOs on 2013-03-14.
+      assert([row[0] for row in c.fetchall()] == [5])
+      c.execute("EXPLAIN QUERY PLAN SELECT id FROM test WHERE qso_timestamp BETWEEN ? AND ?", [1363132800, 1363219200])
+      plan = " ".join([str(t[-1]) for t in c.fetchall()])
+      print "Query plan: ", plan
+      assert("test_qso_timestamp" in plan)
+
+   def test_log_callsign_filter(self):
+      query = "INSERT INTO test VALUES (NULL, ?, ?, ?, ?, ?, ?, ?, ?)"
+      c = self.connection.cursor()
+      for callsign in ["TEST123", "M0ABC", "test456", "ATEST", "TESU1"]:
+         c.execute(query, (callsign, self.fields_and_data["QSO_DATE"], self.fields_and_data["TIME_ON"], self.fields_and_data["FREQ"], self.fields_and_data["BAND"], self.fields_and_data["MODE"], self.fields_and_data["RST_SENT"], self.fields_and_data["RST_RCVD"]))
+      self.log.add_missing_db_indexes()
+
+      self.log.callsign_filter = "tEsT"
+      self.log.populate()
+      assert(list(self.log.rowids) == [1, 3])
+
+      # New records should only be shown if they match the filter.
+      self.log.add_record({"CALL":"TEST789"})
+      self.log.add_record({"CALL":"M0XYZ"})
+      assert(list(self.log.rowids) == [1, 3, 6])
+
+      self.log.callsign_filter = ""
+      self.log.populate()
+      assert(list(self.log.rowids) == [1, 2, 3, 4, 5, 6, 7])
+
    def test_log_add_record(self):
       self.log.add_record(self.fields_and_data)
       c = self.connection.cursor()
@@ -298,6 +1432,56 @@ class TestLog(unittest.TestCase):
          print self.fields_and_data[field_name], records[0][field_name]
          assert self.fields_and_data[field_name] == records[0][field_name]
 
+   def test_log_add_records(self):
+      records = [self.fields_and_data, {"CALL":"TEST456", "BAND":"40m", "MODE":"CW"}, {"CALL":"TEST789"}]
+      added = self.log.add_records(records, batch_size=2)
+      c = self.connection.cursor()
+      c.execute("SELECT * FROM test")
+      records_after = c.fetchall()
+
+      assert(added == 3)
+      assert(len(records_after) == 3)
+      for field_name in self.field_names:
+         assert(records_after[0][field_name] == self.fields_and_data[field_name])
+      assert(records_after[1]["CALL"] == "TEST456")
+      assert(records_after[1]["MODE"] == "CW")
+      assert(records_after[1]["FREQ"] == "")
+      assert(records_after[2]["CALL"] == "TEST789")
+
+   def test_log_import_records(self):
+      records = [({"CALL":"TEST%d" % i, "QSO_DATE":"20130312", "TIME_ON":"1234"}, 100*(i+1)) for i in range(0, 25)]
+      path = "/path/to/log.adi"
+      assert(self.log.get_import_checkpoint(path, "hash") is None)
+
+      # Stop the import after two batches. The checkpoint should point just after the last committed record.
+      (added, complete) = self.log.import_records(records, path, "hash", batch_size=10, progress=lambda total, position, after_index, last_index: total < 20)
+      assert(added == 20 and not complete)
+      assert(self.log.get_import_checkpoint(path, "hash") == (2000, 20))
+      # The checkpoint should not be used if the file has changed.
+      assert(self.log.get_import_checkpoint(path, "another hash") is None)
+
+      # Resume the import from the checkpoint.
+      (added, complete) = self.log.import_records(records[20:], path, "hash", batch_size=10)
+      assert(added == 5 and complete)
+      assert(self.log.get_import_checkpoint(path, "hash") is None)
+      assert(self.log.get_number_of_records() == 25)
+      assert([record["CALL"] for record in self.log.get_all_records()] == ["TEST%d" % i for i in range(0, 25)])
+
+   def test_log_add_imported_records(self):
+      self.log.populate()
+      (query, field_names) = self.log._get_insert_query()
+      records = [({"CALL":"TEST%d" % i}, i) for i in range(0, 3)]
+      # Import the records in the same way as an import running in another thread would, and add each batch to the Log as it is committed.
+      batches = []
+      (added, complete) = run_import(self.connection, self.log.name, query, field_names, records, "/path/to/log.adi", "hash", batch_size=2,
+                                     progress=lambda total, position, after_index, last_index: batches.append((after_index, last_index)))
+      assert(added == 3 and complete)
+      assert(batches == [(0, 2), (2, 3)])
+      for (after_index, last_index) in batches:
+         self.log.add_imported_records(after_index, last_index)
+      assert(list(self.log.rowids) == [1, 2, 3])
+      assert(self.log.get_value(self.log.get_iter(Gtk.TreePath(2)), 1) == "TEST2")
+
    def test_log_delete_record(self):
       query = "INSERT INTO test VALUES (NULL, ?, ?, ?, ?, ?, ?, ?, ?)"
       c = self.connection.cursor()
@@ -333,6 +1517,23 @@ class TestLog(unittest.TestCase):
       assert(record_before["FREQ"] == "145.500")
       assert(record_after["FREQ"] == "145.450")
 
+   def test_log_remove_duplicates(self):
+      query = "INSERT INTO test VALUES (NULL, ?, ?, ?, ?, ?, ?, ?, ?)"
+      c = self.connection.cursor()
+      # Add the same record three times, with a different record in between.
+      for callsign in ["TEST123", "TEST123", "TEST456", "TEST123"]:
+         c.execute(query, (callsign, self.fields_and_data["QSO_DATE"], self.fields_and_data["TIME_ON"], self.fields_and_data["FREQ"], self.fields_and_data["BAND"], self.fields_and_data["MODE"], self.fields_and_data["RST_SENT"], self.fields_and_data["RST_RCVD"]))
+      self.log.populate()
+
+      (number_of_duplicates, number_of_duplicates_removed) = self.log.remove_duplicates()
+      print "Number of duplicates found: ", number_of_duplicates
+      print "Number of duplicates removed: ", number_of_duplicates_removed
+      assert(number_of_duplicates == 2)
+      assert(number_of_duplicates_removed == 2)
+      assert(list(self.log.rowids) == [1, 3])
+      assert(self.log.get_number_of_records() == 2)
+      assert(self.log.remove_duplicates() == (0, 0))
+
    def test_log_get_record_by_index(self):
       query = "INSERT INTO test VALUES (NULL, ?, ?, ?, ?, ?, ?, ?, ?)"
       c = self.connection.cursor()
@@ -361,6 +1562,63 @@ class TestLog(unittest.TestCase):
          assert(records[0][field_name] == self.fields_and_data[field_name])
          assert(records[1][field_name] == self.fields_and_data[field_name])
 
+   def test_log_search(self):
+      self.log.add_missing_fts_index()
+      self.log.add_record({"CALL":"TEST123", "NOTES":"Worked on a new antenna", "NAME":"Bob"})
+      self.log.add_record({"CALL":"TEST456", "NOTES":"Antenna test. Another antenna test.", "COUNTRY":"England"})
+      self.log.add_record({"CALL":"TEST789", "NAME":"Alice"})
+
+      results = self.log.search("ANTENNA")
+      print "Search results: ", [(rank, record["CALL"]) for (rank, record) in results]
+      # The record that mentions the search term most often should be ranked first.
+      assert([record["CALL"] for (rank, record) in results] == ["TEST456", "TEST123"])
+      assert([record["CALL"] for (rank, record) in self.log.search("ANTENNA", limit=1, offset=1)] == ["TEST123"])
+      assert([record["CALL"] for (rank, record) in self.log.search("ant bob")] == ["TEST123"])
+      assert(self.log.search("\"") == [])
+
+      # The index should be kept up-to-date when records are edited or deleted.
+      self.log.edit_record(3, "NOTES", "Antenna problems")
+      self.log.delete_record(2)
+      assert(sorted([record["CALL"] for (rank, record) in self.log.search("antenna")]) == ["TEST123", "TEST789"])
+
+      # An index should be created for a log with existing records, and should survive the log being renamed.
+      c = self.connection.cursor()
+      c.execute("ALTER TABLE test RENAME TO test2")
+      c.execute("ALTER TABLE %s RENAME TO %s" % (get_fts_table_name("test"), get_fts_table_name("test2")))
+      self.log.name = "test2"
+      self.log.invalidate_schema_cache()
+      self.log.add_missing_fts_index()
+      self.log.add_record({"CALL":"TEST000", "NOTES":"Antenna"})
+      c.execute("SELECT name FROM sqlite_master WHERE type='trigger'")
+      trigger_names = [t[0] for t in c.fetchall()]
+      print "Trigger names: ", trigger_names
+      assert(sorted(trigger_names) == ["test2_fts_delete", "test2_fts_insert", "test2_fts_update"])
+      assert(len(self.log.search("antenna")) == 3)
+
+   def test_log_query(self):
+      query = "INSERT INTO test VALUES (NULL, ?, ?, ?, ?, ?, ?, ?, ?)"
+      c = self.connection.cursor()
+      for (callsign, qso_date, time_on, band, mode) in [("TEST1", "20130311", "2359", "2m", "FM"), ("TEST2", "20130312", "0000", "40m", "CW"), ("TEST3", "20130312", "2359", "2M", "fm"), ("TEST4", "20130313", "0000", "20m", "SSB")]:
+         c.execute(query, (callsign, qso_date, time_on, self.fields_and_data["FREQ"], band, mode, self.fields_and_data["RST_SENT"], self.fields_and_data["RST_RCVD"]))
+
+      records = self.log.query(date_from="20130312", date_to="20130312")
+      assert(not isinstance(records, list)) # The records should be fetched lazily.
+      assert([record["CALL"] for record in records] == ["TEST2", "TEST3"])
+      assert([record["CALL"] for record in self.log.query(bands=["2m"], modes=["FM"])] == ["TEST1", "TEST3"])
+      assert([record["CALL"] for record in self.log.query(where={"MODE":"CW"})] == ["TEST2"])
+      assert([record["CALL"] for record in self.log.query(order_by="QSO_DATE", descending=True, limit=2, offset=1)] == ["TEST3", "TEST2"])
+      assert([record["CALL"] for record in self.log.query(offset=3)] == ["TEST4"])
+      assert([record["CALL"] for record in self.log.query(order_by="CALL", descending=True, offset=1, page_size=2)] == ["TEST3", "TEST2", "TEST1"])
+
+      # Each page is fetched separately, so the log can be modified in the middle of a query.
+      records = self.log.query(page_size=1)
+      assert(next(records)["CALL"] == "TEST1")
+      self.log.add_record({"CALL":"TEST5"})
+      self.log.delete_record(2)
+      assert([record["CALL"] for record in records] == ["TEST3", "TEST4", "TEST5"])
+      assert(self.log.query(where={"NOT_A_FIELD":"TEST"}) is None)
+      assert(self.log.query(date_from="2013-03-12") is None)
+
    def test_log_get_number_of_records(self):
       query = "INSERT INTO test VALUES (NULL, ?, ?, ?, ?, ?, ?, ?, ?)"
       c = self.connection.cursor()
@@ -372,6 +1630,14 @@ class TestLog(unittest.TestCase):
       print "Number of records in the log: ", number_of_records
       assert(number_of_records == 2) # There should be 2 records
 
+   def test_log_get_worked_counts(self):
+      self.log.add_missing_db_columns()
+      for (call, band, mode, dxcc) in [("test123", "2m", "FM", "223"), ("TEST123", "2M", "fm", "223"), ("TEST123", "40m", "CW", None), ("TEST123", "40m", "", None), ("M0ABC", "20m", "SSB", "223")]:
+         self.log.add_record({"CALL":call, "BAND":band, "MODE":mode, "DXCC":dxcc})
+
+      counts = self.log.get_worked_counts()
+      print "Worked counts: ", counts
+      assert(sorted(counts) == [("M0ABC", "20m", "SSB", "223", 1), ("TEST123", "2m", "FM", "223", 2), ("TEST123", "40m", "CW", None, 1)])
 
 if(__name__ == '__main__'):
    unittest.main()
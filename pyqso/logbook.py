@@ -29,6 +29,12 @@ from adif import *
 from log import *
 from log_name_dialog import *
 from auxiliary_dialogs import *
+from search_dialog import *
+from import_dialog import *
+from import_worker import *
+
+# The time (in milliseconds) to wait after the last change to the callsign filter before re-filtering the logs.
+FILTER_DELAY = 300
 
 class Logbook(Gtk.Notebook):
    """ A Logbook object can store multiple Log objects. """
@@ -41,6 +47,9 @@ class Logbook(Gtk.Notebook):
       self.connection = None
       self.summary = {}
       self.logs = []
+      self.loading = {} # The idle handlers of the logs that are currently being populated, keyed by Log object.
+      self.importing = {} # The background imports that are currently running, keyed by the Log object that the records are being imported into.
+      self.filter_timeout = None # The timer that re-filters the selected log once the user has stopped typing in the callsign filter.
       logging.debug("New Logbook instance created!")
       return
    
@@ -58,13 +67,14 @@ class Logbook(Gtk.Notebook):
          try:
             with self.connection:
                c = self.connection.cursor()
+               create_checkpoint_table(c)
                c.execute("SELECT name FROM sqlite_master WHERE type='table'")
                names = c.fetchall()
                for name in names:
-                  if(name[0][0:7] == "sqlite_"):
-                     continue # Skip SQLite internal tables
+                  if(name[0][0:7] == "sqlite_" or name[0].startswith(INTERNAL_TABLE_PREFIX)):
+                     continue # Skip SQLite internal tables, and PyQSO's own tables (e.g. the full-text search indexes).
+                  # Note: The logs are not populated here. Each log is only populated when its tab is first selected.
                   l = Log(self.connection, name[0])
-                  l.populate()
                   self.logs.append(l)
          except (sqlite.Error, IndexError) as e:
             logging.exception(e)
@@ -75,8 +85,6 @@ class Logbook(Gtk.Notebook):
          # For rendering the logs. One treeview and one treeselection per Log.
          self.treeview = []
          self.treeselection = []
-         self.sorter = []
-         self.filter = []
          self._create_summary_page()
          self._create_dummy_page()
 
@@ -97,6 +105,7 @@ class Logbook(Gtk.Notebook):
          self.parent.menu.set_logbook_item_sensitive(False)
          self.parent.menu.set_log_items_sensitive(True)
          self.parent.toolbar.filter_source.set_sensitive(True)
+         self.parent.toolbar.search_source.set_sensitive(True)
 
          self.show_all()
 
@@ -108,6 +117,13 @@ class Logbook(Gtk.Notebook):
    def close(self, widget=None):
       """ Close the logbook that is currently open. """
 
+      # Stop populating any logs before the database connection goes away.
+      if(self.filter_timeout is not None):
+         GObject.source_remove(self.filter_timeout)
+         self.filter_timeout = None
+      for log in self.loading.keys():
+         self._stop_loading(log)
+
       disconnected = self.db_disconnect()
       if(disconnected):
          logging.debug("Closing all logs in the logbook...")
@@ -115,6 +131,7 @@ class Logbook(Gtk.Notebook):
             # Once a page is removed, the other pages get re-numbered,
             # so a 'for' loop isn't the best option here.
             self.remove_page(0)
+         self.logs = []
          logging.debug("All logs now closed.")
 
          context_id = self.parent.statusbar.get_context_id("Status")
@@ -123,6 +140,7 @@ class Logbook(Gtk.Notebook):
          self.parent.menu.set_logbook_item_sensitive(True)
          self.parent.menu.set_log_items_sensitive(False)
          self.parent.toolbar.filter_source.set_sensitive(False)
+         self.parent.toolbar.search_source.set_sensitive(False)
       else:
          logging.debug("Unable to disconnect from the database. No logs were closed.")
       return
@@ -170,12 +188,17 @@ class Logbook(Gtk.Notebook):
    def db_disconnect(self):
       """ Destroy the connection to the Logbook's data source. """
       logging.debug("Cleaning up any existing database connections...")
+      # Stop any imports that are still running. They can be resumed from their checkpoints when the logbook is next opened.
+      for worker in self.importing.values():
+         worker.stop()
+      self.importing = {}
       if(self.connection):
          try:
             self.connection.close()
          except sqlite.Error as e:
             logging.exception(e)
             return False
+         self.connection = None
       else:
          logging.debug("Already disconnected. Nothing to do here.")
       return True
@@ -267,6 +290,72 @@ class Logbook(Gtk.Notebook):
       else:
          self.parent.toolbar.set_record_buttons_sensitive(True)
          self.parent.menu.set_record_items_sensitive(True)
+         if(new_page != self.get_n_pages()-1):
+            # Populate the log now that it is being viewed (if this has not been done already).
+            # Note that 'label' is actually the page's Gtk.VBox, which has the same name as its log.
+            log_index = self._get_log_index(name=label.get_name())
+            if(log_index is not None):
+               self._start_loading(self.logs[log_index])
+      return
+
+   def _start_loading(self, log, force=False):
+      """ Start populating a log from an idle handler, a chunk of records at a time, so that the user interface stays responsive while a large log is loaded.
+      Only the records that match the callsign filter in the toolbar are loaded.
+      Nothing is done if the log has already been populated (or is being populated) with the same callsign filter, unless 'force' is True. """
+      callsign = self.parent.toolbar.filter_source.get_text()
+      if(callsign is None):
+         callsign = ""
+      if(not force and (log.populated or log in self.loading) and log.callsign_filter == callsign):
+         return
+      self._stop_loading(log)
+      log.callsign_filter = callsign
+      logging.debug("Loading log '%s'..." % log.name)
+      populator = self._load_incrementally(log)
+      self.loading[log] = GObject.idle_add(self._on_loading_idle, log, populator)
+      return
+
+   def _load_incrementally(self, log):
+      """ A generator which converts a log to typed columns (if the user wants this, and it has not been done already) and then populates it, a chunk at a time. """
+      if(self._use_typed_columns() and not log.has_typed_columns() and log not in self.importing):
+         # Migrate the log to the typed schema, now that it is going to be (re-)populated anyway. The progress is shown in the status bar.
+         # Note: A log that records are being imported into is converted the next time it is loaded instead.
+         logging.debug("Converting log '%s' to typed columns..." % log.name)
+         context_id = self.parent.statusbar.get_context_id("Conversion")
+         try:
+            for fraction in log.convert_to_typed_columns_incrementally():
+               self.parent.statusbar.pop(context_id)
+               self.parent.statusbar.push(context_id, "Converting log %s to typed columns... %d%%" % (log.name, int(fraction*100)))
+               yield fraction
+         finally:
+            self.parent.statusbar.pop(context_id)
+         if(not log.has_typed_columns()):
+            error(parent=self.parent, message="Database error. Could not convert log %s to typed columns." % log.name)
+      for number_of_records in log.populate_incrementally():
+         yield number_of_records
+      return
+
+   def _use_typed_columns(self):
+      """ Return True if the user wants the numeric fields of each log to be stored in typed database columns (see the General page of the Preferences dialog),
+      and False otherwise. """
+      config = ConfigParser.ConfigParser()
+      have_config = (config.read(expanduser('~/.pyqso.ini')) != [])
+      (section, option) = ("general", "typed_columns")
+      return (have_config and config.has_option(section, option) and config.get(section, option) == "True")
+
+   def _on_loading_idle(self, log, populator):
+      """ Populate the next chunk of a log. Return True (to keep the idle handler going) until the whole log has been populated. """
+      try:
+         next(populator)
+         return True
+      except StopIteration:
+         del self.loading[log]
+         logging.debug("Log '%s' loaded." % log.name)
+         return False
+
+   def _stop_loading(self, log):
+      """ Stop populating a log, if it is currently being populated. """
+      if(log in self.loading):
+         GObject.source_remove(self.loading.pop(log))
       return
 
    def new_log(self, widget=None):
@@ -279,15 +368,13 @@ class Logbook(Gtk.Notebook):
          response = dialog.run()
          if(response == Gtk.ResponseType.OK):
             log_name = dialog.get_log_name()
+            if(log_name.startswith(INTERNAL_TABLE_PREFIX)):
+               error(parent=self.parent, message="Log names cannot start with '%s'. Try another log name." % INTERNAL_TABLE_PREFIX)
+               continue
             try:
                with self.connection:
                   c = self.connection.cursor()
-                  query = "CREATE TABLE %s (id INTEGER PRIMARY KEY AUTOINCREMENT" % log_name
-                  for field_name in AVAILABLE_FIELD_NAMES_ORDERED:
-                     s = ", %s TEXT" % field_name.lower()
-                     query = query + s
-                  query = query + ")"
-                  c.execute(query)
+                  c.execute(get_create_table_query(log_name, typed=self._use_typed_columns()))
                   exists = False
             except sqlite.Error as e:
                logging.exception(e)
@@ -334,12 +421,19 @@ class Logbook(Gtk.Notebook):
          logging.debug("No logs to delete!")
          return
 
+      if(log in self.importing):
+         error(parent=self.parent, message="Records are still being imported into log %s. Stop the import before deleting the log." % log.name)
+         return
+
       response = question(parent=self.parent, message="Are you sure you want to delete log %s?" % log.name)
       if(response == Gtk.ResponseType.YES):
+         self._stop_loading(log)
          try:
             with self.connection:
                c = self.connection.cursor()
                c.execute("DROP TABLE %s" % log.name)
+               c.execute("DROP TABLE IF EXISTS %s" % get_fts_table_name(log.name))
+               c.execute("DELETE FROM %s WHERE log_name=?" % CHECKPOINT_TABLE, [log.name])
          except sqlite.Error as e:
             logging.exception(e)
             error(parent=self.parent, message="Database error. Could not delete the log.")
@@ -349,8 +443,6 @@ class Logbook(Gtk.Notebook):
          # Remove the log from the renderers too
          self.treeview.pop(log_index)
          self.treeselection.pop(log_index)
-         self.sorter.pop(log_index)
-         self.filter.pop(log_index)
          # And finally remove the tab in the Logbook
          self.remove_page(page_index)
 
@@ -359,33 +451,38 @@ class Logbook(Gtk.Notebook):
       return
 
    def filter_logs(self, widget):
-      """ Re-filter all the logs when the user-defined expression is changed. """
-      for i in range(0, len(self.filter)):
-         self.filter[i].refilter()
+      """ Re-filter the log that is currently selected when the user-defined expression is changed.
+      The filtering is only done once the user has stopped typing for FILTER_DELAY milliseconds. The other logs are re-filtered when they are next selected. """
+      if(self.filter_timeout is not None):
+         GObject.source_remove(self.filter_timeout)
+      self.filter_timeout = GObject.timeout_add(FILTER_DELAY, self._on_filter_timeout)
       return
 
-   def _filter_by_callsign(self, model, iter, data):
-      """ Filter all the logs in the logbook by the callsign field, based on a user-defined expression. """
-      value = model.get_value(iter, 1)
-      callsign = self.parent.toolbar.filter_source.get_text()
-      
-      if(callsign is None or callsign == ""):
-         # If there is nothing to filter with, then show all the records!
-         return True
-      else:
-         # This should be case insensitive. 
-         # Also, we could use value[:][0:len(callsign))] if we wanted to match from the very start of each callsign.
-         return callsign.upper() in value or callsign.lower() in value
+   def _on_filter_timeout(self):
+      """ Re-populate the log that is currently selected, using the callsign filter. Always returns False so that the timer only runs once. """
+      self.filter_timeout = None
+      log_index = self._get_log_index()
+      if(log_index is not None):
+         self._start_loading(self.logs[log_index])
+      return False
+
+   def search_logs(self, widget):
+      """ Search the notes, names, addresses and countries of the records in all the logs for the text in the toolbar's search box, and show the results. """
+      if(self.connection is None):
+         return
+      text = self.parent.toolbar.search_source.get_text()
+      if(get_fts_query(text) is None):
+         return # Nothing to search for.
+      dialog = SearchDialog(parent=self.parent, logbook=self, text=text)
+      dialog.run()
+      dialog.destroy()
+      return
 
    def _render_log(self, index):
       """ Render the Log (identified by 'index') in the Gtk.Notebook. """
-      self.filter.append(self.logs[index].filter_new(root=None))
-      # Set the callsign column as the column we want to filter by
-      self.filter[index].set_visible_func(self._filter_by_callsign, data=None)
-      self.sorter.append(Gtk.TreeModelSort(model=self.filter[index]))
-      self.sorter[index].set_sort_column_id(0, Gtk.SortType.ASCENDING)
-
-      self.treeview.append(Gtk.TreeView(self.sorter[index]))
+      # Note: The logs are filtered and sorted by the database (see _start_loading and sort_log), so the TreeView uses the Log model directly
+      # rather than a Gtk.TreeModelFilter or Gtk.TreeModelSort (which would have to go through every record in the log).
+      self.treeview.append(Gtk.TreeView(self.logs[index]))
       self.treeview[index].set_grid_lines(Gtk.TreeViewGridLines.BOTH)
       self.treeview[index].connect("row-activated", self.edit_record_callback)
       self.treeselection.append(self.treeview[index].get_selection())
@@ -399,13 +496,7 @@ class Logbook(Gtk.Notebook):
       vbox.set_name(self.logs[index].name) # Set a name for the tab itself so we can match it up with the associated Log object later.
       vbox.pack_start(sw, True, True, 0)
 
-      # Add a close button to the tab
-      hbox = Gtk.HBox(False, 0)
-      label = Gtk.Label(self.logs[index].name)
-      hbox.pack_start(label, False, False, 0)
-      hbox.show_all()
-
-      self.insert_page(vbox, hbox, index+1) # Append the new log as a new tab
+      self.insert_page(vbox, self._create_tab_label(self.logs[index]), index+1) # Append the new log as a new tab
 
       # The first column of the logbook will always be the unique record index.
       # Let's append this separately to the field names.
@@ -447,74 +538,54 @@ class Logbook(Gtk.Notebook):
       self.show_all()
       return
 
-   def _compare_date_and_time(self, model, row1, row2, user_data):
-      """ Compares two rows in a Gtk.ListStore, and sorts by both date and time. """
-      date1 = model.get_value(row1, user_data[0])
-      date2 = model.get_value(row2, user_data[0])
-      time1 = model.get_value(row1, user_data[1])
-      time2 = model.get_value(row2, user_data[1])
-      if(date1 < date2):
-         return 1
-      elif(date1 == date2):
-         # If the dates are the same, then let's also sort by time.
-         if(time1 > time2):
-            return -1
-         elif(time1 == time2):
-            return 0
-         else:
-            return 1
-      else:
-         return -1
-
-   def _compare_default(self, model, row1, row2, user_data):
-      """ The default sorting function for all Gtk.ListStore objects. """
-      value1 = model.get_value(row1, user_data)
-      value2 = model.get_value(row2, user_data)
-      if(value1 < value2):
-         return 1
-      elif(value1 == value2):
-         return 0
-      else:
-         return -1
+   def _create_tab_label(self, log):
+      """ Return a tab label for a given log. This shows the log's name, and the number of records in the log when the mouse hovers over it. """
+      hbox = Gtk.HBox(False, 0)
+      label = Gtk.Label(log.name)
+      # The number of records is only counted when the tooltip is about to be shown, so it never goes out-of-date
+      # and the log does not need to be populated to count its records.
+      label.set_has_tooltip(True)
+      label.connect("query-tooltip", self._on_tab_label_query_tooltip, log)
+      hbox.pack_start(label, False, False, 0)
+      hbox.show_all()
+      return hbox
+
+   def _on_tab_label_query_tooltip(self, widget, x, y, keyboard_mode, tooltip, log):
+      """ Show the number of records in a log when the mouse hovers over the log's tab. """
+      number_of_records = log.get_number_of_records()
+      if(number_of_records is None):
+         return False
+      tooltip.set_text("%d record(s)" % number_of_records)
+      return True
 
    def sort_log(self, widget, column_index):
-      """ Sort the log (that is currently selected) based on the column identified by column_index. """
+      """ Sort the log (that is currently selected) based on the column identified by column_index. The sorting is done by the database (see Log.sort). """
       log_index = self._get_log_index()
-      column = self.treeview[log_index].get_column(column_index)
+      log = self.logs[log_index]
+      if(column_index == 0):
+         field_name = None # Sort by the index.
+      else:
+         field_name = AVAILABLE_FIELD_NAMES_ORDERED[column_index-1]
 
-      if(AVAILABLE_FIELD_NAMES_ORDERED[column_index-1] == "QSO_DATE"):
-         # If the field being sorted is the QSO_DATE, then also sort by the TIME_ON field so we get the
-         # correct chronological order.
-         # Note: This assumes that the TIME_ON field is always immediately to the right of the QSO_DATE field.
-         self.sorter[log_index].set_sort_func(column_index, self._compare_date_and_time, user_data=[column_index, column_index+1])
+      # If we are operating on the currently-sorted column, then reverse the order of sorting.
+      # Otherwise, change to the new sorted column. Default to ascending order.
+      if(log.sort_field_name == field_name):
+         descending = not log.sort_descending
       else:
-         self.sorter[log_index].set_sort_func(column_index, self._compare_default, user_data=column_index)
-
-      # If we are operating on the currently-sorted column...
-      if(self.sorter[log_index].get_sort_column_id()[0] == column_index):
-         order = column.get_sort_order()
-         # ...then check if we need to reverse the order of searching.
-         if(order == Gtk.SortType.ASCENDING):
-            self.sorter[log_index].set_sort_column_id(column_index, Gtk.SortType.DESCENDING)
-            column.set_sort_order(Gtk.SortType.DESCENDING)
-         else:
-            self.sorter[log_index].set_sort_column_id(column_index, Gtk.SortType.ASCENDING)
-            column.set_sort_order(Gtk.SortType.ASCENDING)
+         descending = False
+      if(not log.sort(field_name, descending)):
+         # The log has not been populated yet (or is out-of-date), so (re-)populate it in the new order.
+         self._start_loading(log, force=True)
+
+      # Show an arrow pointing in the direction of the sorting, on the sorted column only.
+      for column in self.treeview[log_index].get_columns():
+         column.set_sort_indicator(False)
+      column = self.treeview[log_index].get_column(column_index)
+      column.set_sort_indicator(True)
+      if(descending):
+         column.set_sort_order(Gtk.SortType.DESCENDING)
       else:
-         # Otherwise, change to the new sorted column. Default to ASCENDING order.
-         self.sorter[log_index].set_sort_column_id(column_index, Gtk.SortType.ASCENDING)
          column.set_sort_order(Gtk.SortType.ASCENDING)
-
-         # Show an arrow pointing in the direction of the sorting.
-         # (First we need to remove the arrow from the previously-sorted column.
-         # Since we don't know which one that was, just remove the arrow from all columns
-         # and start again. This only loops over a few dozen columns at most, so
-         # hopefully it won't take too much time.)
-         for i in range(0, len(AVAILABLE_FIELD_NAMES_ORDERED)):
-            column = self.treeview[log_index].get_column(i)
-            column.set_sort_indicator(False)
-         column = self.treeview[log_index].get_column(column_index)
-         column.set_sort_indicator(True)
       return
       
    def rename_log(self, widget=None):
@@ -529,6 +600,9 @@ class Logbook(Gtk.Notebook):
       old_log_name = page.get_name()
       
       log_index = self._get_log_index(name=old_log_name)
+      if(self.logs[log_index] in self.importing):
+         error(parent=self.parent, message="Records are still being imported into log %s. Stop the import before renaming the log." % old_log_name)
+         return
       
       exists = True
       dialog = LogNameDialog(self.parent, title="Rename Log", name=old_log_name)
@@ -536,11 +610,20 @@ class Logbook(Gtk.Notebook):
          response = dialog.run()
          if(response == Gtk.ResponseType.OK):
             new_log_name = dialog.get_log_name()
+            if(new_log_name.startswith(INTERNAL_TABLE_PREFIX)):
+               error(parent=self.parent, message="Log names cannot start with '%s'. Try another log name." % INTERNAL_TABLE_PREFIX)
+               continue
             try:
                with self.connection:
                   c = self.connection.cursor()
                   query = "ALTER TABLE %s RENAME TO %s" % (old_log_name, new_log_name)
                   c.execute(query)
+                  # Rename the log's full-text search index (if it has one) in the same transaction.
+                  c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", [get_fts_table_name(old_log_name)])
+                  if(c.fetchone() is not None):
+                     c.execute("ALTER TABLE %s RENAME TO %s" % (get_fts_table_name(old_log_name), get_fts_table_name(new_log_name)))
+                  # Any unfinished imports into the log can still be resumed after it has been renamed.
+                  c.execute("UPDATE %s SET log_name=? WHERE log_name=?" % CHECKPOINT_TABLE, [new_log_name, old_log_name])
                   exists = False
             except sqlite.Error as e:
                logging.exception(e)
@@ -555,16 +638,18 @@ class Logbook(Gtk.Notebook):
       
       # Remember to change the Log object's name...
       self.logs[log_index].name = new_log_name
+      # ...and to forget any SQL queries that use the old table name...
+      self.logs[log_index].invalidate_schema_cache()
+      # ...and to give the table's indexes names that match the new table name (so the old names are free to use again)...
+      self.logs[log_index].add_missing_db_indexes()
+      # ...and to replace the triggers that keep the full-text search index (and the timestamp column) up-to-date...
+      self.logs[log_index].add_missing_fts_index()
       
       # ...and the page's name
       page.set_name(self.logs[log_index].name)
 
       # ...and update the tab's label
-      hbox = Gtk.HBox(False, 0)
-      label = Gtk.Label(new_log_name)
-      hbox.pack_start(label, False, False, 0)
-      hbox.show_all()
-      self.set_tab_label(page, hbox)
+      self.set_tab_label(page, self._create_tab_label(self.logs[log_index]))
       
       # The number of logs will obviously stay the same, but
       # we want to update the logbook's modification date.
@@ -605,10 +690,16 @@ class Logbook(Gtk.Notebook):
          response = dialog.run()
          if(response == Gtk.ResponseType.OK):
             log_name = dialog.get_log_name()
+            if(log_name.startswith(INTERNAL_TABLE_PREFIX)):
+               error(parent=self.parent, message="Log names cannot start with '%s'. Try another log name." % INTERNAL_TABLE_PREFIX)
+               continue
             if(self.log_name_exists(log_name)):
                # Import into existing log
                exists = True
                l = self.logs[self._get_log_index(name=log_name)]
+               if(l in self.importing):
+                  error(parent=self.parent, message="Records are already being imported into log %s. Try another log name." % log_name)
+                  continue
                response = question(parent=self.parent, message="Are you sure you want to import into an existing log?")
                if(response == Gtk.ResponseType.YES):
                   break
@@ -623,12 +714,7 @@ class Logbook(Gtk.Notebook):
                try:
                   with self.connection:
                      c = self.connection.cursor()
-                     query = "CREATE TABLE %s (id INTEGER PRIMARY KEY AUTOINCREMENT" % log_name
-                     for field_name in AVAILABLE_FIELD_NAMES_ORDERED:
-                        s = ", %s TEXT" % field_name.lower()
-                        query = query + s
-                     query = query + ")"
-                     c.execute(query)
+                     c.execute(get_create_table_query(log_name, typed=self._use_typed_columns()))
                      l = Log(self.connection, log_name)
                      break
                except sqlite.Error as e:
@@ -641,19 +727,62 @@ class Logbook(Gtk.Notebook):
       
       dialog.destroy()
 
-      adif = ADIF()
-      records = adif.read(path)      
-      logging.debug("Importing records from the ADIF file with path: %s" % path)
-      for record in records:
-         l.add_record(record)
-      l.populate()
+      try:
+         file_hash = get_file_hash(path)
+      except OSError as e:
+         logging.exception(e)
+         error(parent=self.parent, message="Could not read the ADIF file %s." % path)
+         return
+      start = 0
+      records = 0
+      checkpoint = l.get_import_checkpoint(path, file_hash)
+      if(checkpoint is not None):
+         response = question(parent=self.parent, message="An earlier import of this file into log %s was stopped after %d record(s). Do you want to carry on from where it stopped? Otherwise, the whole file will be imported again." % (l.name, checkpoint[1]))
+         if(response == Gtk.ResponseType.YES):
+            (start, records) = checkpoint
+         else:
+            l.remove_import_checkpoint(path)
 
       if(not exists):
          self.logs.append(l)
          self._render_log(self.get_number_of_logs()-1)
-      self.update_summary()
-      self.parent.toolbox.awards.count()
-      
+         l.populate() # The new log is empty, so this is quick. The imported records are then added to it as they are committed.
+
+      # Bring the log's database table up-to-date before the import starts, since the records are inserted using the table's current columns.
+      # A log that has not been viewed yet may still have been created by an older version of PyQSO.
+      l.add_missing_db_columns()
+      if(not l.add_missing_timestamp_column()):
+         error(parent=self.parent, message="Database error. Could not import the records into log %s." % l.name)
+         return
+
+      logging.debug("Importing records from the ADIF file with path: %s" % path)
+      # Stream the records straight from the file into the database in batches, in a background thread.
+      # Each batch is shown in the log's tab as soon as it has been committed, and the user can carry on using the rest of the logbook in the meantime.
+      state = {"missed":False} # Becomes True if any batches are committed while the log is not fully populated.
+      def on_progress(total, position, after_index, last_index):
+         if(l.populated):
+            l.add_imported_records(after_index, last_index)
+         else:
+            state["missed"] = True
+         progress_dialog.update(total, position)
+         return False
+      def on_finished(added, complete):
+         progress_dialog.destroy()
+         self.importing.pop(l, None) # The logbook may have been closed (which stops all the imports) in the meantime.
+         if(self.connection is not connection or l not in self.logs):
+            return False # The logbook has been closed (or another one opened) in the meantime.
+         if(state["missed"] or not l.populated):
+            self._start_loading(l, force=True)
+         self.update_summary()
+         self.parent.toolbox.awards.count()
+         if(not complete):
+            info(parent=self.parent, message="The import was stopped after %d record(s). Import the same file into log %s again to carry on from where it stopped." % (records + added, l.name))
+         return False
+      connection = self.connection # The connection to the logbook that the records are being imported into.
+      worker = ImportWorker(self.path, l, path, file_hash, start=start, records=records, on_progress=on_progress, on_finished=on_finished)
+      progress_dialog = ImportProgressDialog(self.parent, path, start=start, records=records, on_stop=worker.stop)
+      self.importing[l] = worker
+      worker.start()
       return
       
    def export_log(self, widget=None):
@@ -694,7 +823,8 @@ class Logbook(Gtk.Notebook):
          logging.debug("No file path specified.")
       else:
          adif = ADIF()
-         records = log.get_all_records()
+         # Stream the records from the database into the file a page at a time, rather than fetching them all into memory first.
+         records = log.query()
          if(records is not None):
             adif.write(records, path)
          else:
@@ -712,10 +842,12 @@ class Logbook(Gtk.Notebook):
       log = self.logs[log_index]
 
       self.text_to_print = "Callsign\t---\tDate\t---\tTime\t---\tFrequency\t---\tMode\n"
-      records = log.get_all_records()
+      records = log.query() # Go through the records one at a time, rather than fetching them all at once.
       if(records is not None):
+         lines = [self.text_to_print]
          for r in records:
-            self.text_to_print += str(r["CALL"]) + "\t---\t" + str(r["QSO_DATE"]) + "\t---\t" + str(r["TIME_ON"]) + "\t---\t" + str(r["FREQ"]) + "\t---\t" + str(r["MODE"]) + "\n"
+            lines.append(str(r["CALL"]) + "\t---\t" + str(r["QSO_DATE"]) + "\t---\t" + str(r["TIME_ON"]) + "\t---\t" + str(r["FREQ"]) + "\t---\t" + str(r["MODE"]) + "\n")
+         self.text_to_print = "".join(lines)
 
          action = Gtk.PrintOperationAction.PRINT_DIALOG
          operation = Gtk.PrintOperation()
@@ -788,19 +920,19 @@ class Logbook(Gtk.Notebook):
             fields_and_data = {}
             field_names = AVAILABLE_FIELD_NAMES_ORDERED
             for i in range(0, len(field_names)):
-               #TODO: Validate user input!
                fields_and_data[field_names[i]] = dialog.get_data(field_names[i])
-               if(not(adif.is_valid(field_names[i], fields_and_data[field_names[i]], AVAILABLE_FIELD_NAMES_TYPES[field_names[i]]))):
-                  # Data is not valid - inform the user.
-                  error(parent=self.parent, message="The data in field \"%s\" is not valid!" % field_names[i])
-                  all_valid = False
-                  break # Don't check the other data until the user has fixed the current one.
+            invalid_field_names = adif.validate_record(fields_and_data)
+            if(len(invalid_field_names) > 0):
+               # Data is not valid - inform the user about the first invalid field.
+               # The other fields will be checked again once the user has fixed it.
+               error(parent=self.parent, message="The data in field \"%s\" is not valid!" % invalid_field_names[0])
+               all_valid = False
 
             if(all_valid):
                # All data has been validated, so we can go ahead and add the new record.
                log.add_record(fields_and_data)
                self.update_summary()
-               self.parent.toolbox.awards.count()
+               self.parent.toolbox.awards.on_record_added(fields_and_data)
                # Select the new Record's row in the treeview.
                number_of_records = log.get_number_of_records()
                if(number_of_records is not None):
@@ -812,15 +944,10 @@ class Logbook(Gtk.Notebook):
    def delete_record_callback(self, widget):
       log_index = self._get_log_index()
       log = self.logs[log_index]
-      (sort_model, path) = self.treeselection[log_index].get_selected_rows() # Get the selected row in the log
+      (model, path) = self.treeselection[log_index].get_selected_rows() # Get the selected row in the log
       try:
-         sort_iter = sort_model.get_iter(path[0])
-         # Remember that the filter model is a child of the sort model...
-         filter_model = sort_model.get_model()
-         filter_iter = self.sorter[log_index].convert_iter_to_child_iter(sort_iter)
-         # ...and the ListStore model (i.e. the log) is a child of the filter model.
-         child_iter = self.filter[log_index].convert_iter_to_child_iter(filter_iter)
-         row_index = log.get_value(child_iter,0)
+         iter = model.get_iter(path[0])
+         row_index = log.get_value(iter,0)
       except IndexError:
          logging.debug("Trying to delete a record, but there are no records in the log!")
          return
@@ -828,10 +955,14 @@ class Logbook(Gtk.Notebook):
       response = question(parent=self.parent, message = "Are you sure you want to delete record %d?" % row_index)
       if(response == Gtk.ResponseType.YES):
          # Deletes the record with index 'row_index' from the Records list.
-         # 'iter' is needed to remove the record from the ListStore itself.
-         log.delete_record(row_index, iter=child_iter)
+         # 'iter' is needed to remove the record from the Log model itself.
+         record = log.get_record_by_index(row_index) # Keep a copy of the record so the awards table knows what has been deleted.
+         log.delete_record(row_index, iter=iter)
          self.update_summary()
-         self.parent.toolbox.awards.count()
+         if(record is not None):
+            self.parent.toolbox.awards.on_record_deleted(record)
+         else:
+            self.parent.toolbox.awards.count()
       return
 
    def edit_record_callback(self, widget, path, view_column):
@@ -841,15 +972,10 @@ class Logbook(Gtk.Notebook):
       log_index = self._get_log_index()
       log = self.logs[log_index]
 
-      (sort_model, path) = self.treeselection[log_index].get_selected_rows() # Get the selected row in the log
+      (model, path) = self.treeselection[log_index].get_selected_rows() # Get the selected row in the log
       try:
-         sort_iter = sort_model.get_iter(path[0])
-         # Remember that the filter model is a child of the sort model...
-         filter_model = sort_model.get_model()
-         filter_iter = self.sorter[log_index].convert_iter_to_child_iter(sort_iter)
-         # ...and the ListStore model (i.e. the log) is a child of the filter model.
-         child_iter = self.filter[log_index].convert_iter_to_child_iter(filter_iter)
-         row_index = log.get_value(child_iter,0)
+         iter = model.get_iter(path[0])
+         row_index = log.get_value(iter,0)
       except IndexError:
          logging.debug("Could not find the selected row's index!")
          return
@@ -868,13 +994,13 @@ class Logbook(Gtk.Notebook):
             fields_and_data = {}
             field_names = AVAILABLE_FIELD_NAMES_ORDERED
             for i in range(0, len(field_names)):
-               #TODO: Validate user input!
                fields_and_data[field_names[i]] = dialog.get_data(field_names[i])
-               if(not(adif.is_valid(field_names[i], fields_and_data[field_names[i]], AVAILABLE_FIELD_NAMES_TYPES[field_names[i]]))):
-                  # Data is not valid - inform the user.
-                  error(parent=self.parent, message="The data in field \"%s\" is not valid!" % field_names[i])
-                  all_valid = False
-                  break # Don't check the other fields until the user has fixed the current field's data.
+            invalid_field_names = adif.validate_record(fields_and_data)
+            if(len(invalid_field_names) > 0):
+               # Data is not valid - inform the user about the first invalid field.
+               # The other fields will be checked again once the user has fixed it.
+               error(parent=self.parent, message="The data in field \"%s\" is not valid!" % invalid_field_names[0])
+               all_valid = False
 
             if(all_valid):
                # All data has been validated, so we can go ahead and update the record.
@@ -887,11 +1013,11 @@ class Logbook(Gtk.Notebook):
                   for i in range(0, len(field_names)):
                      # Check whether the data has actually changed. Database updates can be expensive.
                      if(record[field_names[i].lower()] != fields_and_data[field_names[i]]):
-                        # Update the record in the database and then in the ListStore.
+                        # Update the record in the database and then in the Log model.
                         # We add 1 onto the column_index here because we don't want to consider the index column.
-                        log.edit_record(row_index, field_names[i], fields_and_data[field_names[i]], iter=child_iter, column_index=i+1)
+                        log.edit_record(row_index, field_names[i], fields_and_data[field_names[i]], iter=iter, column_index=i+1)
                   self.update_summary()
-                  self.parent.toolbox.awards.count()
+                  self.parent.toolbox.awards.on_record_changed(record, fields_and_data)
 
       dialog.destroy()
       return
@@ -905,6 +1031,10 @@ class Logbook(Gtk.Notebook):
       log = self.logs[log_index]
 
       (number_of_duplicates, number_of_duplicates_removed) = log.remove_duplicates()
+      if(number_of_duplicates_removed > 0):
+         # The duplicates were counted in the awards table (and the index of worked stations), so these need to be re-counted.
+         self.update_summary()
+         self.parent.toolbox.awards.count()
       info(self.parent, "Found %d duplicate(s). Successfully removed %d duplicate(s)." % (number_of_duplicates, number_of_duplicates_removed))
       return
 
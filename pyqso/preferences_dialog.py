@@ -124,6 +124,20 @@ class GeneralPage(Gtk.VBox):
       frame.add(hbox)
       self.pack_start(frame, False, False, 2)
 
+      frame = Gtk.Frame()
+      frame.set_label("Logbook")
+      hbox = Gtk.HBox()
+      self.sources["TYPED_COLUMNS"] = Gtk.CheckButton("Store numeric fields (e.g. frequency) as numbers in the database")
+      self.sources["TYPED_COLUMNS"].set_tooltip_text("Existing logs are converted when they are next opened. This cannot be undone.")
+      (section, option) = ("general", "typed_columns")
+      if(have_config and config.has_option(section, option)):
+         self.sources["TYPED_COLUMNS"].set_active(config.get(section, option) == "True")
+      else:
+         self.sources["TYPED_COLUMNS"].set_active(False)
+      hbox.pack_start(self.sources["TYPED_COLUMNS"], False, False, 2)
+      frame.add(hbox)
+      self.pack_start(frame, False, False, 2)
+
       logging.debug("General page of the preferences dialog ready!")
       return
 
@@ -131,6 +145,7 @@ class GeneralPage(Gtk.VBox):
       logging.debug("Retrieving data from the General page of the preferences dialog...")
       data = {}
       data["SHOW_TOOLBOX"] = self.sources["SHOW_TOOLBOX"].get_active()
+      data["TYPED_COLUMNS"] = self.sources["TYPED_COLUMNS"].get_active()
       return data
 
 class ViewPage(Gtk.VBox):
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# File: search_dialog.py
+
+#    Copyright (C) 2013 Christian Jacobs.
+
+#    This file is part of PyQSO.
+
+#    PyQSO is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    PyQSO is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with PyQSO.  If not, see <http://www.gnu.org/licenses/>.
+
+from gi.repository import Gtk, GObject
+import logging
+
+from adif import AVAILABLE_FIELD_NAMES_FRIENDLY
+from log import SEARCH_PAGE_SIZE
+
+class SearchDialog(Gtk.Dialog):
+   """ A dialog which shows the records (from all the logs in the logbook) that match a full-text search of their notes, names, addresses and countries.
+   The best matches are shown first, one page at a time. """
+
+   def __init__(self, parent, logbook, text):
+      logging.debug("Setting up the search dialog...")
+
+      Gtk.Dialog.__init__(self, title="Search Results", parent=parent, flags=Gtk.DialogFlags.DESTROY_WITH_PARENT, buttons=(Gtk.STOCK_CLOSE, Gtk.ResponseType.CLOSE))
+
+      self.logbook = logbook
+      self.text = text
+      self.page_number = 0
+
+      # The log name, record index, and a few of the record's fields, for each matching record.
+      self.field_names = ["CALL", "QSO_DATE", "TIME_ON", "NAME", "COUNTRY", "NOTES"]
+      self.results = Gtk.ListStore(*([str, int] + [str]*len(self.field_names)))
+      treeview = Gtk.TreeView(self.results)
+      treeview.set_grid_lines(Gtk.TreeViewGridLines.BOTH)
+      treeview.connect("row-activated", self._on_row_activated)
+      column_names = ["Log", "Index"] + [AVAILABLE_FIELD_NAMES_FRIENDLY[field_name] for field_name in self.field_names]
+      for i in range(0, len(column_names)):
+         renderer = Gtk.CellRendererText()
+         column = Gtk.TreeViewColumn(column_names[i], renderer, text=i)
+         column.set_resizable(True)
+         column.set_min_width(50)
+         treeview.append_column(column)
+      sw = Gtk.ScrolledWindow()
+      sw.set_shadow_type(Gtk.ShadowType.ETCHED_IN)
+      sw.set_policy(Gtk.PolicyType.AUTOMATIC, Gtk.PolicyType.AUTOMATIC)
+      sw.add(treeview)
+      self.vbox.pack_start(sw, True, True, 6)
+
+      # Buttons to move between the pages of results.
+      hbox_temp = Gtk.HBox(spacing=0)
+      self.previous_button = Gtk.Button(stock=Gtk.STOCK_GO_BACK)
+      self.previous_button.connect("clicked", self._on_previous_clicked)
+      hbox_temp.pack_start(self.previous_button, False, False, 6)
+      self.page_label = Gtk.Label()
+      hbox_temp.pack_start(self.page_label, True, True, 6)
+      self.next_button = Gtk.Button(stock=Gtk.STOCK_GO_FORWARD)
+      self.next_button.connect("clicked", self._on_next_clicked)
+      hbox_temp.pack_start(self.next_button, False, False, 6)
+      self.vbox.pack_start(hbox_temp, False, False, 6)
+
+      self.set_default_size(700, 400)
+      self.show_page(0)
+
+      logging.debug("Search dialog ready!")
+
+      self.show_all()
+      return
+
+   def search(self, page_number):
+      """ Return a tuple containing a list of the (rank, log name, record) tuples on a given page of the search results (best match first),
+      and True if there are more pages after it (False otherwise). """
+      # Each log ranks its own matches, so only the best matches up to the end of the requested page need to be fetched from each log.
+      # One more match than is needed is fetched to find out whether there is another page.
+      limit = (page_number+1)*SEARCH_PAGE_SIZE + 1
+      matches = []
+      for log in self.logbook.logs:
+         results = log.search(self.text, limit=limit)
+         if(results is None):
+            logging.error("Could not search log '%s'." % log.name)
+            continue
+         matches.extend([(rank, log.name, record) for (rank, record) in results])
+      matches.sort(key=lambda match: match[0])
+      start = page_number*SEARCH_PAGE_SIZE
+      return (matches[start:start+SEARCH_PAGE_SIZE], len(matches) > start+SEARCH_PAGE_SIZE)
+
+   def show_page(self, page_number):
+      """ Show a given page of the search results. """
+      (matches, more) = self.search(page_number)
+      self.page_number = page_number
+      self.results.clear()
+      for (rank, log_name, record) in matches:
+         row = [log_name, record["id"]]
+         for field_name in self.field_names:
+            data = record[field_name]
+            if(data is None):
+               data = ""
+            row.append(data)
+         self.results.append(row)
+
+      if(len(matches) == 0 and page_number == 0):
+         self.page_label.set_text("No matching records found.")
+      else:
+         self.page_label.set_text("Page %d" % (page_number+1))
+      self.previous_button.set_sensitive(page_number > 0)
+      self.next_button.set_sensitive(more)
+      return
+
+   def _on_previous_clicked(self, widget):
+      self.show_page(self.page_number-1)
+      return
+
+   def _on_next_clicked(self, widget):
+      self.show_page(self.page_number+1)
+      return
+
+   def _on_row_activated(self, widget, path, view_column):
+      """ Switch to the tab of the log containing the selected record. """
+      log_index = self.logbook._get_log_index(name=self.results[path][0])
+      if(log_index is not None):
+         self.logbook.set_current_page(log_index+1) # The first page is the Summary page.
+      self.response(Gtk.ResponseType.CLOSE)
+      return
+
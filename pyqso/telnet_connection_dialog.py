@@ -23,6 +23,9 @@ import logging
 import re
 import calendar
 
+# The default number of seconds to wait for a Telnet server to accept a connection (and for each step of the login) before giving up.
+DEFAULT_TIMEOUT = 10
+
 class TelnetConnectionDialog(Gtk.Dialog):
    """ A simple dialog through which users can specify host and login information for a Telnet server. 
    This can be used to connect to DX clusters. """
@@ -71,6 +74,16 @@ class TelnetConnectionDialog(Gtk.Dialog):
       hbox_temp.pack_start(self.sources["PASSWORD"], True, True, 6)
       self.vbox.pack_start(hbox_temp, False, False, 6)
 
+      hbox_temp = Gtk.HBox(spacing=0)
+      label = Gtk.Label("Timeout (s): ", halign=Gtk.Align.START)
+      label.set_width_chars(12)
+      label.set_alignment(0, 0.5)
+      hbox_temp.pack_start(label, False, False, 6)
+      self.sources["TIMEOUT"] = Gtk.Entry()
+      self.sources["TIMEOUT"].set_text(str(DEFAULT_TIMEOUT))
+      hbox_temp.pack_start(self.sources["TIMEOUT"], True, True, 6)
+      self.vbox.pack_start(hbox_temp, False, False, 6)
+
       logging.debug("Telnet connection dialog ready!") 
 
       self.show_all()
@@ -92,10 +92,22 @@ class Toolbar(Gtk.HBox):
       self.filter_source.connect_after("changed", parent.logbook.filter_logs)
       self.pack_start(self.filter_source, False, False, 0)
 
+      self.pack_start(Gtk.SeparatorToolItem(), False, False, 0)
+
+      # Search all logs
+      label = Gtk.Label("Search: ")
+      self.pack_start(label, False, False, 0)
+      self.search_source = Gtk.Entry()
+      self.search_source.set_width_chars(15)
+      self.search_source.set_tooltip_text('Search the notes, names, addresses and countries in all logs (press Enter to search)')
+      self.search_source.connect("activate", parent.logbook.search_logs)
+      self.pack_start(self.search_source, False, False, 0)
+
       self.set_logbook_button_sensitive(True)
       self.set_record_buttons_sensitive(False)
 
       self.filter_source.set_sensitive(False)
+      self.search_source.set_sensitive(False)
 
       logging.debug("Toolbar ready!") 
 
@@ -43,6 +43,8 @@ class Toolbox(Gtk.Frame):
       self.tools.insert_page(self.grey_line, Gtk.Label("Grey Line"), 1)
       self.awards = Awards(self.parent)
       self.tools.insert_page(self.awards, Gtk.Label("Awards"), 2)
+      # Keep the worked-before status of the DX spots up-to-date as records are added to (or removed from) the logbook.
+      self.awards.connect("worked-index-changed", self.dx_cluster.update_spot_status)
 
       self.add(self.tools)
       self.tools.connect_after("switch-page", self._on_switch_page)